@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Element,Theme,Room,Answer,UserGameSession
+from .models import Element,Theme,Room,Answer,UserGameSession,GeneratedImage
 admin.site.register(Element)
 admin.site.register(Theme)
 admin.site.register(Room)
 admin.site.register(Answer)
 admin.site.register(UserGameSession)
+admin.site.register(GeneratedImage)
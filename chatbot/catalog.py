@@ -0,0 +1,126 @@
+"""
+Process-wide snapshot of the puzzle catalog (themes, rooms, elements, answers).
+
+The catalog only changes when someone edits it in the admin or runs
+populate_db, so every worker builds it once and shares it between requests.
+Edits bump a version stamp in the CatalogVersion row (see
+chatbot/signals.py). Workers read the stamp at most every
+CATALOG_VERSION_CHECK_INTERVAL seconds and rebuild when it has moved, so an
+edit reaches every worker on every node within that interval.
+"""
+import threading
+import time
+import uuid
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .matching import AnswerMatcher, ElementIndex
+from .models import CatalogVersion, Room, Element
+from .text import get_nlp, lemmatize, normalize_string
+
+_lock = threading.Lock()
+_catalog = None
+# (stamp, time.monotonic() it was read) for this process
+_version = None
+
+
+class Catalog:
+    """Immutable, versioned view of the puzzle content"""
+
+    def __init__(self, version, themes, rooms):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.themes = MappingProxyType(themes)
+        self.rooms = MappingProxyType(rooms)
+        self.room_order = tuple(rooms)
+
+    def is_stale(self, version):
+        if self.version != version:
+            return True
+        max_age = getattr(settings, 'CATALOG_MAX_AGE', 300)
+        return max_age is not None and time.monotonic() - self.built_at > max_age
+
+
+def build_catalog(version):
+    rooms = Room.objects.select_related('theme').prefetch_related(
+        Prefetch('elements',
+            queryset=Element.objects.prefetch_related('answers')
+        )
+    )
+
+    themes = {}
+    room_data = {}
+    for room in rooms:
+        theme_key = normalize_string(room.theme.name)
+        themes[theme_key] = room.theme
+        elements = {
+            normalize_string(element.name): _element_data(element)
+            for element in room.elements.all()
+        }
+        room_data[theme_key] = MappingProxyType({
+            "description": room.description,
+            "elements": MappingProxyType(elements),
+            "index": ElementIndex(elements),
+            "room_name": room.name
+        })
+    return Catalog(version, themes, room_data)
+
+
+def _element_data(element):
+    answers = tuple(answer.answer for answer in element.answers.all())
+    return MappingProxyType({
+        "puzzle": element.puzzle,
+        "hint": element.hint,
+        "answers": answers,
+        # Answers are lemmatized here, once per rebuild, not on every attempt,
+        # and not through preprocess_text: its cache and counters are sized
+        # for player input
+        "matcher": AnswerMatcher(lemmatize(get_nlp(), normalize_string(answer)) for answer in answers)
+    })
+
+
+def current_version():
+    """
+    Return the shared catalog version stamp, creating it on first use. The
+    row is read at most once per CATALOG_VERSION_CHECK_INTERVAL seconds.
+    """
+    global _version
+    interval = getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 2)
+    known = _version
+    if known is not None and time.monotonic() - known[1] < interval:
+        return known[0]
+
+    version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+    if version is None:
+        version = CatalogVersion.objects.get_or_create(pk=1, defaults={'version': uuid.uuid4().hex})[0].version
+    _version = (version, time.monotonic())
+    return version
+
+
+def get_catalog():
+    """Return the current catalog snapshot, rebuilding it only when stale"""
+    global _catalog
+    version = current_version()
+    catalog = _catalog
+    if catalog is None or catalog.is_stale(version):
+        with _lock:
+            catalog = _catalog
+            if catalog is None or catalog.is_stale(version):
+                catalog = _catalog = build_catalog(version)
+    return catalog
+
+
+def invalidate_catalog():
+    """Drop this worker's snapshot and bump the version for every other one"""
+    def bump():
+        global _catalog, _version
+        CatalogVersion.objects.update_or_create(pk=1, defaults={'version': uuid.uuid4().hex})
+        _catalog = None
+        _version = None
+
+    # Rebuilding before the edit is committed would snapshot the old rows
+    # under the new version, so wait for the transaction to land.
+    transaction.on_commit(bump)
@@ -0,0 +1,64 @@
+"""
+Encoding stage for generated images.
+
+Diffusion output is photographic, which PNG compresses poorly and slowly, so
+images are stored in IMAGE_FORMAT (WebP by default, or progressive JPEG) at
+IMAGE_QUALITY. Each image is kept in several renditions, scaled from the
+requested size by IMAGE_RENDITIONS, so small screens can fetch a small one.
+"""
+import io
+
+from django.conf import settings
+
+FULL = 'full'
+
+# Pillow format name -> (content type, save options given a quality)
+FORMATS = {
+    'WEBP': ('image/webp', lambda quality: {'quality': quality, 'method': 4}),
+    'JPEG': ('image/jpeg', lambda quality: {'quality': quality, 'progressive': True, 'optimize': True}),
+    'PNG': ('image/png', lambda quality: {}),
+}
+
+DEFAULT_RENDITIONS = {FULL: 1.0, 'small': 0.5}
+
+
+def image_format():
+    return getattr(settings, 'IMAGE_FORMAT', 'WEBP').upper()
+
+
+def renditions():
+    """Rendition name -> scale of the requested size; always includes FULL"""
+    configured = getattr(settings, 'IMAGE_RENDITIONS', DEFAULT_RENDITIONS)
+    return {FULL: 1.0, **configured}
+
+
+def encode(image, format=None, quality=None):
+    """Encode a PIL image; returns (bytes, content type)"""
+    format = (format or image_format()).upper()
+    if quality is None:
+        quality = getattr(settings, 'IMAGE_QUALITY', 80)
+    try:
+        content_type, options = FORMATS[format]
+    except KeyError:
+        raise ValueError(f"Unsupported image format: {format}")
+
+    if format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffered = io.BytesIO()
+    image.save(buffered, format=format, **options(quality))
+    return buffered.getvalue(), content_type
+
+
+def encode_renditions(image, size, format=None, quality=None):
+    """
+    Scale image to every rendition of size and encode it; returns a list of
+    (rendition, bytes, content type), largest first.
+    """
+    encoded = []
+    for name, scale in sorted(renditions().items(), key=lambda item: -item[1]):
+        bounds = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        rendition = image.copy()
+        rendition.thumbnail(bounds)
+        data, content_type = encode(rendition, format, quality)
+        encoded.append((name, data, content_type))
+    return encoded
@@ -0,0 +1,205 @@
+"""
+Content-addressed store for generated images.
+
+An image is fully determined by the model, prompt, generation parameters and
+output size, so a hash of those is its key. Stored in the database, entries
+are visible to every worker and node and survive redeploys; the store is
+capped at IMAGE_CACHE_MAX_BYTES and evicts the least recently used images.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .encoding import FULL, encode_renditions
+from .inference import get_inference_client
+from .lru import LRUCache
+from .metrics import timed
+from .models import GeneratedImage
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
+
+IMAGE_PARAMETERS = {
+    "negative_prompt": "blurry, low quality, bad composition",
+    "num_inference_steps": 30,
+    "guidance_scale": 7.5
+}
+
+ROOM_IMAGE_SIZE = (800, 600)
+ELEMENT_IMAGE_SIZE = (400, 400)
+
+# Hits refresh accessed_at at most this often, so reads rarely cost a write
+TOUCH_INTERVAL = timedelta(hours=1)
+
+
+def inference_url():
+    return getattr(settings, 'HF_INFERENCE_URL', None) or INFERENCE_URL
+
+
+def room_image_prompt(room_description):
+    return f"A detailed, atmospheric view of: {room_description}. Cinematic lighting, detailed interior, mystery atmosphere"
+
+
+def element_image_prompt(element_name, puzzle_text):
+    return f"Mysterious {element_name} related to the puzzle: {puzzle_text}. Dark, cyberpunk detective style, with dramatic lighting and intrigue"
+
+
+def image_key(prompt, parameters, size):
+    """Stable hash of everything that determines a generated image"""
+    payload = json.dumps(
+        {
+            "url": inference_url(),
+            "prompt": prompt,
+            "parameters": parameters,
+            "size": list(size),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ImageStore:
+
+    def __init__(self):
+        # Keys known to be stored; images never change once stored, so only
+        # an eviction (rare, least recently used first) makes an entry stale.
+        # Another worker's eviction is noticed when the image is next served.
+        self._known = LRUCache(10000)
+
+    def get_entry(self, key, rendition=FULL):
+        """Stored GeneratedImage for key's rendition, or None"""
+        image = GeneratedImage.objects.filter(key=key, rendition=rendition).first()
+        if image is None:
+            if rendition == FULL:
+                # Evicted elsewhere, so the next request may generate it again
+                self._known.discard(key)
+            return None
+        self._known.set(key, True)
+        now = timezone.now()
+        if now - image.accessed_at > TOUCH_INTERVAL:
+            GeneratedImage.objects.filter(pk=image.pk).update(accessed_at=now)
+        return image
+
+    def get(self, key, rendition=FULL):
+        """Stored image bytes for key's rendition, or None"""
+        image = self.get_entry(key, rendition)
+        return bytes(image.data) if image else None
+
+    def exists(self, key):
+        if self._known.get(key):
+            return True
+        if GeneratedImage.objects.filter(key=key, rendition=FULL).exists():
+            self._known.set(key, True)
+            return True
+        return False
+
+    async def aexists(self, key):
+        if self._known.get(key):
+            return True
+        if await GeneratedImage.objects.filter(key=key, rendition=FULL).aexists():
+            self._known.set(key, True)
+            return True
+        return False
+
+    def put(self, key, renditions):
+        """Store (rendition, bytes, content type) entries for key, all or none"""
+        try:
+            with transaction.atomic():
+                GeneratedImage.objects.bulk_create(
+                    GeneratedImage(
+                        key=key, rendition=rendition, data=data,
+                        content_type=content_type, size=len(data)
+                    )
+                    for rendition, data, content_type in renditions
+                )
+        except IntegrityError:
+            # Another worker stored the same image first
+            return
+        self._known.set(key, True)
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used images until the store fits its budget"""
+        max_bytes = getattr(settings, 'IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        total = GeneratedImage.objects.aggregate(total=Sum('size'))['total'] or 0
+        if total <= max_bytes:
+            return
+
+        # Renditions of an image are evicted together
+        images = GeneratedImage.objects.values('key').annotate(
+            total_size=Sum('size'), last_access=Max('accessed_at')
+        ).order_by('last_access')
+        evicted = []
+        for image in images:
+            if total <= max_bytes:
+                break
+            evicted.append(image['key'])
+            self._known.discard(image['key'])
+            total -= image['total_size']
+        GeneratedImage.objects.filter(key__in=evicted).delete()
+        logger.info(f"Evicted {len(evicted)} cached images")
+
+
+image_store = ImageStore()
+
+
+def render_image(key, prompt, size, token):
+    """
+    Call the inference API and store every rendition of the image under key;
+    returns whether it was stored. Blocks for the length of the inference call.
+    """
+    try:
+        with timed('inference'):
+            content = get_inference_client().post(
+                inference_url(), token, {"inputs": prompt, "parameters": IMAGE_PARAMETERS}
+            )
+        with timed('image_encode'):
+            renditions = _encode(content, size)
+    except Exception as e:
+        logger.error(f"Image generation failed: {e}")
+        return False
+    image_store.put(key, renditions)
+    return True
+
+
+async def arender_image(key, prompt, size, token):
+    """
+    render_image() for the async job loop: the inference call is awaited,
+    while decoding, encoding and the store write run on worker threads.
+    """
+    try:
+        with timed('inference'):
+            content = await get_inference_client().apost(
+                inference_url(), token, {"inputs": prompt, "parameters": IMAGE_PARAMETERS}
+            )
+        with timed('image_encode'):
+            renditions = await asyncio.to_thread(_encode, content, size)
+    except Exception as e:
+        logger.error(f"Image generation failed: {e}")
+        return False
+    await asyncio.to_thread(_store, key, renditions)
+    return True
+
+
+def _encode(content, size):
+    # Pillow is only needed once an image is actually generated
+    from PIL import Image
+
+    return encode_renditions(Image.open(io.BytesIO(content)), size)
+
+
+def _store(key, renditions):
+    try:
+        image_store.put(key, renditions)
+    finally:
+        # Executor threads are shared by every job; don't leave them holding connections
+        connections.close_all()
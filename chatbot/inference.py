@@ -0,0 +1,243 @@
+"""
+Shared HTTP client for the image inference API.
+
+One pooled, keep-alive session per process, so image jobs reuse TLS
+connections instead of handshaking on every call; async jobs get the same
+behaviour from a pooled httpx client. Overloaded responses are
+retried with exponential backoff and full jitter, honouring Retry-After; a
+circuit breaker fails calls fast while the upstream keeps failing, so jobs
+don't queue up behind requests that are bound to time out.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Worth another attempt: overloaded, model loading or a flaky gateway
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class InferenceError(Exception):
+    pass
+
+
+class CircuitOpenError(InferenceError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls. While open every
+    call fails fast; after `reset_timeout` seconds one trial call is let
+    through, and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Whether a call may go ahead now"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Inference circuit opened")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+def retry_after_seconds(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class InferenceClient:
+
+    def __init__(self, max_retries=3, backoff=1.0, max_backoff=20.0, timeout=30,
+                 pool_size=10, async_pool_size=100, breaker=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        # The HTTP libraries are imported with the first client, not with
+        # the views that may never generate an image
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.async_pool_size = async_pool_size
+        # Created on first use, inside the event loop that will drive it
+        self._async_session = None
+
+    def retry_delay(self, attempt, response=None):
+        """Full-jitter exponential backoff, or the server's Retry-After if given"""
+        if response is not None:
+            retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def post(self, url, token, payload):
+        """
+        POST payload as JSON and return the response body. Raises
+        CircuitOpenError while the upstream is marked down, InferenceError once
+        retries are spent or on a response that retrying won't fix.
+        """
+        import requests
+
+        if not self.breaker.allow():
+            raise CircuitOpenError("Inference API is unavailable; not calling it")
+
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        error = None
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = InferenceError(f"Inference request failed: {e}")
+            else:
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response.content
+                error = InferenceError(
+                    f"Inference API returned {response.status_code}: {response.text[:200]}"
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    # The upstream is up; the request itself is bad
+                    self.breaker.record_success()
+                    raise error
+
+            if attempt < self.max_retries:
+                time.sleep(self.retry_delay(attempt, response))
+
+        self.breaker.record_failure()
+        raise error
+
+    async def apost(self, url, token, payload):
+        """post() for coroutines: same retries, backoff and circuit breaker"""
+        import httpx
+
+        if not self.breaker.allow():
+            raise CircuitOpenError("Inference API is unavailable; not calling it")
+
+        if self._async_session is None:
+            self._async_session = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.async_pool_size,
+                    max_keepalive_connections=self.async_pool_size,
+                ),
+            )
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        error = None
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self._async_session.post(url, headers=headers, json=payload)
+            except httpx.HTTPError as e:
+                error = InferenceError(f"Inference request failed: {e}")
+            else:
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response.content
+                error = InferenceError(
+                    f"Inference API returned {response.status_code}: {response.text[:200]}"
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    raise error
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.retry_delay(attempt, response))
+
+        self.breaker.record_failure()
+        raise error
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_inference_client():
+    """The process-wide client, configured from settings on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient(
+                    max_retries=getattr(settings, 'INFERENCE_MAX_RETRIES', 3),
+                    backoff=getattr(settings, 'INFERENCE_BACKOFF', 1.0),
+                    max_backoff=getattr(settings, 'INFERENCE_MAX_BACKOFF', 20.0),
+                    timeout=getattr(settings, 'INFERENCE_TIMEOUT', 30),
+                    # Every image worker can hold a connection
+                    pool_size=getattr(settings, 'IMAGE_GENERATION_WORKERS', 4),
+                    async_pool_size=getattr(settings, 'IMAGE_GENERATION_ASYNC_LIMIT', 100),
+                    breaker=CircuitBreaker(
+                        failure_threshold=getattr(settings, 'INFERENCE_BREAKER_THRESHOLD', 5),
+                        reset_timeout=getattr(settings, 'INFERENCE_BREAKER_RESET', 30.0),
+                    ),
+                )
+    return _client
@@ -0,0 +1,209 @@
+"""
+Background image generation.
+
+Inference calls take tens of seconds, so requests hand them to a per-process
+thread pool and return straight away. A job's ID is the content key of the
+image it produces: finished jobs are read back from the image store by any
+worker, while pending and failed states are kept in the cache.
+
+Coroutine jobs (submit_image_job_async) run on one event loop thread per
+process instead, so a process can hold IMAGE_GENERATION_ASYNC_LIMIT
+generations in flight rather than one per pool thread.
+
+Status checks read the cache first and only look for the stored image when
+the cache has no state for a job. Streams wait in await_job(), which a job
+running in the same process wakes as it finishes.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .images import image_store
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+# How long pending/failed states are remembered
+STATUS_TIMEOUT = 10 * 60
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'IMAGE_GENERATION_WORKERS', 4),
+    thread_name_prefix='image-generation',
+)
+_running = set()
+_running_lock = threading.Lock()
+# Job ID -> (event loop, asyncio.Event) of every await_job() waiting on it
+_waiters = defaultdict(set)
+
+_loop = None
+_loop_pid = None
+_loop_slots = None
+
+
+def _status_key(job_id):
+    return f'chatbot:image-job:{job_id}'
+
+
+def _claim(key):
+    """Mark key as running here; False if it already runs or is stored"""
+    with _running_lock:
+        if key in _running:
+            return False
+        _running.add(key)
+
+    if image_store.exists(key):
+        with _running_lock:
+            _running.discard(key)
+        return False
+
+    cache.set(_status_key(key), PENDING, STATUS_TIMEOUT)
+    return True
+
+
+def submit_image_job(key, generate, *args):
+    """
+    Generate image `key` in the background with generate(*args), which stores
+    the image and returns a truthy value on success. Returns the job ID.
+    """
+    if _claim(key):
+        _executor.submit(_run, key, generate, args)
+    return key
+
+
+def submit_image_job_async(key, generate, *args):
+    """
+    submit_image_job() for a coroutine function: await generate(*args) on the
+    job event loop. Callable from any thread. Returns the job ID.
+    """
+    if _claim(key):
+        # The task would inherit the caller's context, and with it the
+        # request's Server-Timing breakdown, which outlives the request
+        contextvars.Context().run(
+            asyncio.run_coroutine_threadsafe, _arun(key, generate, args), _event_loop()
+        )
+    return key
+
+
+def _event_loop():
+    global _loop, _loop_pid, _loop_slots
+    with _running_lock:
+        # Threads don't survive fork, so a forked worker starts its own loop
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _loop_slots = asyncio.Semaphore(getattr(settings, 'IMAGE_GENERATION_ASYNC_LIMIT', 100))
+            threading.Thread(
+                target=_loop.run_forever, name='image-generation-loop', daemon=True
+            ).start()
+        return _loop
+
+
+async def _arun(key, generate, args):
+    status = FAILED
+    try:
+        async with _loop_slots:
+            if await generate(*args):
+                status = READY
+    except Exception as e:
+        logger.error(f"Image job {key} failed: {e}")
+    finally:
+        await cache.aset(_status_key(key), status, STATUS_TIMEOUT)
+        _finish(key)
+
+
+def _run(key, generate, args):
+    status = FAILED
+    try:
+        if generate(*args):
+            status = READY
+    except Exception as e:
+        logger.error(f"Image job {key} failed: {e}")
+    finally:
+        cache.set(_status_key(key), status, STATUS_TIMEOUT)
+        _finish(key)
+        # Pool threads outlive requests, so nothing else closes their connections
+        connections.close_all()
+
+
+def _finish(key):
+    """Drop a finished job from the running set and wake its waiters"""
+    with _running_lock:
+        _running.discard(key)
+        waiters = _waiters.pop(key, ())
+    for loop, event in waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # The waiter's loop has closed
+            pass
+
+
+def job_status(job_id):
+    """READY once the image is stored, FAILED if generation gave up, else PENDING"""
+    # The process running a job keeps its state in the cache it set PENDING
+    # in, so only jobs with no state there need the image store
+    status = cache.get(_status_key(job_id))
+    if status is not None:
+        return status
+    if image_store.exists(job_id):
+        return READY
+    # Unknown jobs may still be running on a worker whose status this
+    # worker's cache can't see; clients stop polling after a timeout
+    return PENDING
+
+
+async def ajob_status(job_id):
+    """job_status() for async views"""
+    status = await cache.aget(_status_key(job_id))
+    if status is not None:
+        return status
+    if await image_store.aexists(job_id):
+        return READY
+    return PENDING
+
+
+async def await_job(job_id, timeout):
+    """
+    Status of job_id once it finishes, or PENDING after `timeout` seconds. A
+    job running in this process wakes the waiter when it's done; others are
+    re-checked every IMAGE_STREAM_POLL_INTERVAL seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    waiter = (loop, asyncio.Event())
+    # Registered before the first check, so a job finishing in between
+    # still sets the event
+    with _running_lock:
+        _waiters[job_id].add(waiter)
+    try:
+        while True:
+            status = await ajob_status(job_id)
+            remaining = deadline - loop.time()
+            if status != PENDING or remaining <= 0:
+                return status
+            with _running_lock:
+                running_here = job_id in _running
+            if not running_here:
+                remaining = min(remaining, getattr(settings, 'IMAGE_STREAM_POLL_INTERVAL', 2))
+            try:
+                await asyncio.wait_for(waiter[1].wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        with _running_lock:
+            waiters = _waiters.get(job_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del _waiters[job_id]
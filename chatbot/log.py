@@ -0,0 +1,126 @@
+"""
+Logging that stays off the request path.
+
+QueueingHandler only puts records on an in-memory queue; a listener thread
+formats them and writes them to a file (rotated at LOG_MAX_BYTES) or to
+stderr, so a slow disk delays the listener rather than a request. When the
+queue is full records are dropped and counted, not waited on. JsonFormatter
+writes one JSON object per line.
+
+Threads don't survive fork, so a process that inherits a handler (a
+preloaded gunicorn worker) starts its own queue and listener on its first
+record. Every process rotates its own view of the file; with several
+workers, log to stderr and let the platform collect it.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with `extra` fields included"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and name not in data:
+                data[name] = value
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to a background listener that writes them to `filename`
+    (rotating after max_bytes, keeping backup_count files), or to stderr
+    when no filename is given. The formatter set on this handler is applied
+    by the listener.
+    """
+
+    def __init__(self, filename=None, max_bytes=10 * 1024 * 1024, backup_count=5, queue_size=10000):
+        super().__init__(None)
+        if filename:
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+            self.target = logging.handlers.RotatingFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+            )
+        else:
+            self.target = logging.StreamHandler(sys.stderr)
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, not the caller's
+        self.target.setFormatter(fmt)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(self.queue_size)
+                self.listener = logging.handlers.QueueListener(self.queue, self.target)
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Resolve what can't cross threads safely: arguments may change
+        # after the call, and tracebacks hold frames
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def flush(self):
+        """Wait until every queued record is written"""
+        if self._pid == os.getpid():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        # logging.shutdown() calls this at exit; drain the queue first
+        if self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+        self.target.close()
+        super().close()
+
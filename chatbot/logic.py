@@ -1,51 +1,50 @@
-import spacy
-from fuzzywuzzy import fuzz
+import functools
 import time
-import unicodedata
-from chatbot.models import Theme, Room, Element, Answer
 import traceback
 import logging
-from django.db.models import Prefetch
-import base64
-import io
-from io import BytesIO
-from PIL import Image
 import os
-from PIL import Image    
-import requests
-import random
-from PIL import Image, ImageDraw, ImageFont
-from dotenv import load_dotenv
-from .models import UserGameSession
-from datetime import timezone
-
-logging.basicConfig(
-    level=logging.ERROR,
-    format='%(asctime)s - %(levelname)s: %(message)s',
-    filename='game_errors.log'
+from .state import GameSessionUnitOfWork
+from .catalog import get_catalog
+from .images import (
+    ELEMENT_IMAGE_SIZE, IMAGE_PARAMETERS, ROOM_IMAGE_SIZE, arender_image,
+    element_image_prompt, image_key, render_image, room_image_prompt,
 )
+from .jobs import submit_image_job, submit_image_job_async
+from .matching import is_similar_answer
+from .metrics import timed
+from .text import get_nlp, normalize_string, preprocess_text
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def load_environment():
+    """Read .env into the environment, once per process"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
 
 class PuzzleLogic:
-    _nlp = None  # Class-level caching of NLP model
-    
 
     def __init__(self):
-        # Load NLP model only once per class
-        load_dotenv()
+        load_environment()
         self.session_id = None
+        self.game_session = None
+        # Generate images as coroutines on the job event loop (async views)
+        # rather than on the job thread pool
+        self.async_images = False
         self.user_solved_elements = {}
-        self.element_images = {}
 
-        if PuzzleLogic._nlp is None:
-            PuzzleLogic._nlp = spacy.load("en_core_web_md")
-        self.nlp = PuzzleLogic._nlp
+        # Loaded once per process and shared by every PuzzleLogic
+        self.nlp = get_nlp()
 
         self.hf_api_token = os.getenv("HF_API_TOKEN")
         self.hf_token=os.getenv("HF_TOKEN")
         if not self.hf_api_token:
-            logging.error("HF_API_TOKEN is not set in the environment.")
+            logger.error("HF_API_TOKEN is not set in the environment.")
         # Optimize data loading with prefetching
-        self.load_data_optimized()
+        with timed('catalog'):
+            self.load_data_optimized()
         
         # Reset game state
         self.reset_game_state()
@@ -56,24 +55,36 @@ class PuzzleLogic:
     def set_session(self, session_id):
         """Set the current user session ID"""
         self.session_id = session_id
-        # Load or create user session
+        # The session row is the only copy of the player's game state;
+        # changes are written back once, by flush_session
+        self.game_session = GameSessionUnitOfWork(session_id)
         try:
-            session, created = UserGameSession.objects.get_or_create(
-                session_id=session_id,
-                defaults={
-                    'solved_elements': {},
-                    'score': 0,
-                    'lives': 3
-                }
-            )
-            self.user_solved_elements = session.solved_elements
-            self.score = session.score
-            self.lives = session.lives
-            self.current_theme = session.current_theme
+            with timed('session_read'):
+                self.apply_session(self.game_session.load())
         except Exception as e:
-            logging.error(f"Error setting session: {e}")
+            logger.error(f"Error setting session: {e}")
             self.reset_game_state()
 
+    async def aset_session(self, session_id):
+        """set_session() for async views"""
+        self.session_id = session_id
+        self.game_session = GameSessionUnitOfWork(session_id)
+        try:
+            with timed('session_read'):
+                self.apply_session(await self.game_session.aload())
+        except Exception as e:
+            logger.error(f"Error setting session: {e}")
+            self.reset_game_state()
+
+    def apply_session(self, session):
+        self.user_solved_elements = session.solved_elements
+        self.from_dict({
+            **session.state,
+            "score": session.score,
+            "lives": session.lives,
+            "current_theme": session.current_theme,
+        })
+
     def is_element_solved(self, theme, element):
         """Check if element is solved for current user"""
         theme_key = self.normalize_string(theme)
@@ -89,15 +100,31 @@ class PuzzleLogic:
             self.user_solved_elements[theme_key] = {}
         
         self.user_solved_elements[theme_key][element_key] = True
-        
-        # Update database
-        try:
-            UserGameSession.objects.filter(session_id=self.session_id).update(
-                solved_elements=self.user_solved_elements,
-                last_active=timezone.now()
-            )
-        except Exception as e:
-            logging.error(f"Error updating session: {e}")
+
+    def session_fields(self):
+        """The persisted game state, as UserGameSession fields"""
+        state = self.to_dict()
+        return {
+            "solved_elements": self.user_solved_elements,
+            "score": state.pop("score"),
+            "lives": state.pop("lives"),
+            "current_theme": state.pop("current_theme"),
+            "state": state,
+        }
+
+    def flush_session(self):
+        """Write whatever this message changed in one UPDATE"""
+        if self.game_session:
+            self.game_session.update(**self.session_fields())
+            with timed('session_write'):
+                self.game_session.flush()
+
+    async def aflush_session(self):
+        """flush_session() for async views"""
+        if self.game_session:
+            self.game_session.update(**self.session_fields())
+            with timed('session_write'):
+                await self.game_session.aflush()
 
     def reset_game_state(self):
         self.current_room_index = 0
@@ -114,51 +141,22 @@ class PuzzleLogic:
         self.lives = 3
         self.score = 0
         self.hints_used = 0
-        if self.session_id:
-            UserGameSession.objects.filter(session_id=self.session_id).update(
-                solved_elements={},
-                score=0,
-                lives=3,
-                current_theme=None
-            )
-            self.user_solved_elements = {}
+        self.user_solved_elements = {}
 
     def normalize_string(self, text):
-        return unicodedata.normalize('NFKD', text.lower()).strip() if text else text
+        return normalize_string(text)
 
     def load_data_optimized(self):
-        # Use select_related and prefetch_related to reduce database queries
-        rooms = Room.objects.prefetch_related(
-            Prefetch('elements', 
-                queryset=Element.objects.prefetch_related('answers')
-            )
-        )
-
-        self.themes = {
-            self.normalize_string(room.theme.name): room.theme 
-            for room in rooms
-        }
-
-        self.rooms = {
-            self.normalize_string(room.theme.name): {
-                "description": room.description,
-                "elements": {
-                    self.normalize_string(element.name): {
-                        "puzzle": element.puzzle,
-                        "hint": element.hint,
-                        "answers": [answer.answer for answer in element.answers.all()],
-                        "solved": element.solved
-                    } for element in room.elements.all()
-                },
-                "room_name": room.name
-            } for room in rooms
-        }
-        self.room_order = list(self.rooms.keys())
+        # Served from the process-wide snapshot; only rebuilt when the
+        # catalog changes, so this issues no queries on the hot path
+        catalog = get_catalog()
+        self.themes = catalog.themes
+        self.rooms = catalog.rooms
+        self.room_order = list(catalog.room_order)
 
     def start_game(self):
         self.game_started = True
         self.start_time = time.time()
-        self.reset_solved_elements_in_database()
         
         # Return two separate messages
         welcome_message = (
@@ -177,10 +175,6 @@ class PuzzleLogic:
         
         return [welcome_message, scoring_rules]
 
-    def reset_solved_elements_in_database(self):
-        # Bulk update is much faster than individual saves
-        Element.objects.update(solved=False)
-
     def show_themes(self):
         themes_list = "\n\n".join([f"{i+1}. 🌟 **{theme}**" for i, theme in enumerate(self.themes.keys())])
         return (
@@ -199,8 +193,8 @@ class PuzzleLogic:
             self.current_theme = theme_name
             self.lives = 3
             
-            # Generate room image
-            room_image = self.generate_room_image(theme_name)
+            # Room image is generated in the background; the page polls for it
+            room_image_job = self.generate_room_image(theme_name)
             
             # Get room description
             current_room = self.rooms.get(self.normalize_string(theme_name))
@@ -218,7 +212,7 @@ class PuzzleLogic:
             
             return {
                 "text": response_text,
-                "image": room_image,
+                "image_job": room_image_job,
                 
             }
             
@@ -277,38 +271,31 @@ class PuzzleLogic:
             element_data = current_room['elements'][self.current_element]
 
             processed_user_input = self.preprocess_input(user_input)
-            for correct in element_data.get('answers', []):
-                processed_correct_answer = self.preprocess_input(correct)
-                if self.is_similar_answer(processed_correct_answer, processed_user_input):
-                    # Mark element as solved only if not already solved
-                    self.mark_element_solved(current_room_key, self.current_element)
-                    self.score += 10
-
-                    UserGameSession.objects.filter(session_id=self.session_id).update(
-                        solved_elements=self.user_solved_elements,
-                        score=self.score
-                    )
-
-                    # Check remaining puzzles for this user's session
-                    remaining = sum(
-                        1 for elm in current_room['elements'].keys()
-                        if not self.is_element_solved(current_room_key, elm)
-                    )
-                    
-                    if remaining == 0:
-                        return True, f"🎉 Congratulations! Room completed! Score: {self.score} points. Type 'next' for a new theme."
-                    
-                    unsolved = [
-                        element for element in current_room['elements'].keys()
-                        if not self.is_element_solved(current_room_key, element)
-                    ]
-                    element_list = ", ".join(f"🔍 **{elem}**" for elem in unsolved)
-                    
-                    return True, f"🎉 Correct! {remaining} more to solve. Score: {self.score}.\n\nRemaining: {element_list}"
+            with timed('match'):
+                correct = element_data['matcher'].matches(processed_user_input)
+            if correct:
+                # Mark element as solved only if not already solved
+                self.mark_element_solved(current_room_key, self.current_element)
+                self.score += 10
+
+                # Check remaining puzzles for this user's session
+                remaining = sum(
+                    1 for elm in current_room['elements'].keys()
+                    if not self.is_element_solved(current_room_key, elm)
+                )
+                
+                if remaining == 0:
+                    return True, f"🎉 Congratulations! Room completed! Score: {self.score} points. Type 'next' for a new theme."
+                
+                unsolved = [
+                    element for element in current_room['elements'].keys()
+                    if not self.is_element_solved(current_room_key, element)
+                ]
+                element_list = ", ".join(f"🔍 **{elem}**" for elem in unsolved)
+                
+                return True, f"🎉 Correct! {remaining} more to solve. Score: {self.score}.\n\nRemaining: {element_list}"
             
             self.lives -= 1
-            # Update lives in session
-            UserGameSession.objects.filter(session_id=self.session_id).update(lives=self.lives)
             
             if self.lives <= 0:
                 self.reset_game_state()
@@ -317,7 +304,7 @@ class PuzzleLogic:
             return False, f"Incorrect answer. Lives remaining: {self.lives}. Type 'hint' for help."
             
         except Exception as e:
-            logging.error(f"Error in check_element_answer: {e}")
+            logger.error(f"Error in check_element_answer: {e}")
             return False, "An error occurred. Please try again."
                 
 
@@ -325,48 +312,18 @@ class PuzzleLogic:
         """
         More robust preprocessing that handles variations of input
         """
-        if not text:
-            return ""
-        
-        # Normalize and lowercase
-        normalized_text = self.normalize_string(text)
-        
-        # Use NLP for lemmatization and stop word handling
-        doc = self.nlp(normalized_text)
-        
-        # Keep meaningful tokens, including some stop words that might be crucial
-        processed_tokens = [
-            token.lemma_ for token in doc 
-            if not token.is_stop or token.lemma_ in ["is", "am", "are", "be", "was", "were", "a", "an", "the"]
-        ]
-        
-        return " ".join(processed_tokens)
+        with timed('preprocess'):
+            return preprocess_text(text)
 
     def is_similar_answer(self, correct_answer, user_input):
         """
         More precise answer matching with whole word requirements
         """
-        # Exact match first
-        if correct_answer.lower() == user_input.lower():
-            return True
-        
-        # Split inputs into words
-        correct_words = set(correct_answer.lower().split())
-        input_words = set(user_input.lower().split())
-        
-        # Check if the correct answer is a subset of input words
-        if correct_words.issubset(input_words):
-            return True
-        
-        # Fuzzy ratio checking with whole word consideration
-        fuzz_score = fuzz.token_sort_ratio(correct_answer.lower(), user_input.lower())
-        
-        # More strict scoring
-        return fuzz_score > 90  # Increased from previous threshold
+        return is_similar_answer(correct_answer, user_input)
 
     def restart_game(self):
+        # Solved elements are per player and cleared with the rest of the state
         self.reset_game_state()
-        self.reset_solved_elements_in_database()
 
     def play_game(self, user_input):
         if self.game_over:
@@ -428,8 +385,8 @@ class PuzzleLogic:
                 
         
         except Exception as e:
-            logging.error(f"Game error: {e}")
-            logging.error(traceback.format_exc())
+            logger.error(f"Game error: {e}")
+            logger.error(traceback.format_exc())
             return False, f"An unexpected error occurred: {str(e)}"
 
     def provide_hint(self):
@@ -478,158 +435,48 @@ class PuzzleLogic:
         self.game_started = data.get("game_started", False)
         self.lives = data.get("lives", 3)
     
-    import requests
-    import base64
-    import logging
-    import io
-    from PIL import Image
-
-
     def generate_room_image(self, theme_name):
         """
-        Generate an image of the room based on the theme description
+        Start generating an image of the room based on the theme description;
+        returns the job ID to poll, or None
         """
         if not self.hf_api_token:
             return None
-            
-        API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
-        headers = {
-            "Authorization": f"Bearer {self.hf_token}",
-            "Content-Type": "application/json"
-        }
         
         current_room = self.rooms.get(self.normalize_string(theme_name))
         if not current_room:
             return None
             
         # Create a detailed prompt for the room
-        room_description = current_room['description']
-        prompt = f"A detailed, atmospheric view of: {room_description}. Cinematic lighting, detailed interior, mystery atmosphere"
-        
-        max_retries = 3
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                response = requests.post(
-                    API_URL,
-                    headers=headers,
-                    json={
-                        "inputs": prompt,
-                        "parameters": {
-                            "negative_prompt": "blurry, low quality, bad composition",
-                            "num_inference_steps": 30,
-                            "guidance_scale": 7.5
-                        }
-                    },
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    image = Image.open(io.BytesIO(response.content))
-                    image.thumbnail((800, 600))  # Larger size for room image
-                    buffered = io.BytesIO()
-                    image.save(buffered, format="PNG")
-                    return base64.b64encode(buffered.getvalue()).decode('utf-8')
-                    
-                elif response.status_code == 503:
-                    time.sleep(2)
-                    retry_count += 1
-                    continue
-                    
-                else:
-                    logging.error(f"Room image generation error: {response.text}")
-                    retry_count += 1
-                    
-            except Exception as e:
-                logging.error(f"Room image generation exception: {e}")
-                retry_count += 1
-                time.sleep(1)
-                
-        return None
+        prompt = room_image_prompt(current_room['description'])
+        return self.start_image_job(prompt, ROOM_IMAGE_SIZE)
     
     def generate_element_image(self, element_name, puzzle_text):
-        API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
-        headers = {
-            "Authorization": f"Bearer {self.hf_token}",
-            "Content-Type": "application/json"
-        }
-
+        """Start generating an element image; returns the job ID to poll"""
         # Create a prompt that combines the element name and puzzle
-        max_retries = 3
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                prompt = f"Mysterious {element_name} related to the puzzle: {puzzle_text}. Dark, cyberpunk detective style, with dramatic lighting and intrigue"
-                
-                response = requests.post(
-                    API_URL, 
-                    headers=headers, 
-                    json={
-                        "inputs": prompt,
-                        "parameters": {
-                            "negative_prompt": "blurry, low quality, bad composition",
-                            "num_inference_steps": 30,
-                            "guidance_scale": 7.5
-                        }
-                    },
-                    timeout=30  # Add timeout
-                )
+        prompt = element_image_prompt(element_name, puzzle_text)
+        return self.start_image_job(prompt, ELEMENT_IMAGE_SIZE)
 
-                if response.status_code == 200:
-                    image = Image.open(io.BytesIO(response.content))
-                    image.thumbnail((400, 400))
-                    buffered = io.BytesIO()
-                    image.save(buffered, format="PNG")
-                    return base64.b64encode(buffered.getvalue()).decode('utf-8')
-                
-                elif response.status_code == 503:  # Model loading
-                    time.sleep(2)  # Wait before retry
-                    retry_count += 1
-                    continue
-                    
-                else:
-                    logging.error(f"Image generation error: {response.text}")
-                    retry_count += 1
-                    
-            except Exception as e:
-                logging.error(f"Image generation exception: {e}")
-                retry_count += 1
-                time.sleep(1)
-                
-        return None  # Return None if all r
+    def start_image_job(self, prompt, size):
+        # Shared across workers and restarts, keyed by what determines the image
+        key = image_key(prompt, IMAGE_PARAMETERS, size)
+        with timed('image_job'):
+            if self.async_images:
+                return submit_image_job_async(key, arender_image, key, prompt, size, self.hf_token)
+            return submit_image_job(key, render_image, key, prompt, size, self.hf_token)
 
     def interact_with_element(self, user_input):
         normalized_input = self.normalize_string(user_input)
         current_room_key = self.normalize_string(self.current_theme)
         current_room = self.rooms.get(current_room_key, {})
         
-        normalized_elements = {self.normalize_string(k): k for k in current_room.get('elements', {}).keys()}
-        
-        # Extract potential element names from input
-        input_words = set(normalized_input.split())
-        element_words = set(normalized_elements.keys())
-        
-        # Find intersecting words
-        matched_elements = input_words.intersection(element_words)
-        
-        # If no direct match, try fuzzy matching
-        if not matched_elements:
-            best_match = None
-            best_score = 0
-            for element in normalized_elements:
-                score = fuzz.partial_ratio(normalized_input, element)
-                if score > best_score and score > 70:
-                    best_match = element
-                    best_score = score
-                
-            if best_match:
-                matched_elements = {best_match}
+        # Exact, word, prefix and typo lookups against the room's prebuilt index
+        with timed('match'):
+            matched_element = current_room['index'].resolve(normalized_input) if current_room else None
         
         # Process the matched element
-        if matched_elements:
-            original_element = normalized_elements[list(matched_elements)[0]]
+        if matched_element:
+            original_element = matched_element
             
             # Check if element is already solved using the session data
             if self.is_element_solved(current_room_key, original_element):
@@ -642,31 +489,15 @@ class PuzzleLogic:
             self.current_element = original_element
             puzzle_text = element_data['puzzle']
             
-            # Generate image for the element
-            element_key = f"{current_room_key}_{original_element}"
+            # Reuses the stored image, or generates it in the background; a
+            # failed generation shows up as the job's status, not here
+            image_job = self.generate_element_image(original_element, puzzle_text)
             
-            if element_key not in self.element_images:
-                # Generate and cache the image
-                generated_image = self.generate_element_image(original_element, puzzle_text)
-                if generated_image:
-                    self.element_images[element_key] = generated_image
-            
-            # Use cached image if available
-            image = self.element_images.get(element_key)
-            
-            if image:
-                return {
-                    "text": f"Your puzzle for the {original_element} is: {puzzle_text}",
-                    "image": image,
-                    "success": True
-                }
-            else:
-                # If image generation failed
-                return {
-                    "text": f"Image generation failed. Your puzzle for the {original_element} is: {puzzle_text}\nPlease answer the question",
-                    "error": True,
-                    "retry": True
-                }
+            return {
+                "text": f"Your puzzle for the {original_element} is: {puzzle_text}",
+                "image_job": image_job,
+                "success": True
+            }
         
         return {
             "text": "Invalid element. Please type the name of an available element or ask for a hint.",
@@ -0,0 +1,34 @@
+"""Helpers shared by the benchmark management commands"""
+import multiprocessing
+import resource
+
+
+def rss_kb():
+    """Resident set size of the current process in KiB"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Peak rather than current RSS, but close enough where /proc is missing
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values (pct between 0 and 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def run_in_child(func, *args):
+    """
+    Run func(*args) in a forked child and return its result, so memory it
+    allocates is measured in isolation and released afterwards
+    """
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        return pool.apply(func, args)
@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageFilter
+
+from chatbot.encoding import encode, encode_renditions
+from chatbot.images import ELEMENT_IMAGE_SIZE, ROOM_IMAGE_SIZE
+
+from ._bench import percentile
+
+
+def synthetic_image(size=(1024, 1024)):
+    """Smooth gradients under soft noise, closer to diffusion output than flat colour"""
+    noise = Image.effect_noise(size, 40).filter(ImageFilter.GaussianBlur(2))
+    gradient = Image.linear_gradient('L').resize(size)
+    return Image.merge('RGB', (
+        Image.blend(gradient, noise, 0.5),
+        Image.blend(gradient.rotate(90), noise, 0.4),
+        Image.blend(gradient.rotate(180), noise, 0.6),
+    ))
+
+
+class Command(BaseCommand):
+    help = 'Compare encode time and bytes of the stored image formats against plain PNG'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', help='Source image to encode (default: synthetic 1024x1024)')
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--quality', type=int, nargs='+', default=[75, 80, 90])
+
+    def time(self, label, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            size = func()
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"{label:>28}: {percentile(timings, 50):8.1f} ms p50 {percentile(timings, 95):8.1f} ms p95 {size / 1024:9.1f} KiB"
+        )
+
+    def handle(self, *args, **options):
+        if options['image']:
+            source = Image.open(options['image'])
+            source.load()
+        else:
+            source = synthetic_image()
+        repeat = options['repeat']
+
+        for size in (ROOM_IMAGE_SIZE, ELEMENT_IMAGE_SIZE):
+            self.stdout.write(f"{size[0]}x{size[1]} from {source.width}x{source.height}")
+            thumbnail = source.copy()
+            thumbnail.thumbnail(size)
+            # What render_image stored before the encoding stage
+            self.time('PNG (previous)', lambda: len(encode(thumbnail, 'PNG')[0]), repeat)
+            for format in ('WEBP', 'JPEG'):
+                for quality in options['quality']:
+                    self.time(
+                        f'{format} q{quality}',
+                        lambda: len(encode(thumbnail, format, quality)[0]),
+                        repeat,
+                    )
+            self.time(
+                'all renditions (settings)',
+                lambda: sum(len(data) for _, data, _ in encode_renditions(source, size)),
+                repeat,
+            )
@@ -0,0 +1,61 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from rapidfuzz import fuzz
+
+from chatbot.matching import AnswerMatcher, ElementIndex, fuzzy_element_match
+
+
+def typo(word, rng):
+    position = rng.randrange(len(word) + 1)
+    return word[:position] + rng.choice(string.ascii_lowercase) + word[position + 1:]
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark answer verdicts and element-name resolution per second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=20000)
+        parser.add_argument(
+            '--elements', type=int, nargs='+', default=[3, 50, 200, 1000],
+            help='Room sizes to time element-name resolution against'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def rate(self, label, func, inputs):
+        start = time.perf_counter()
+        for value in inputs:
+            func(value)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{label:>40}: {len(inputs) / elapsed:>12,.0f} /s")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        answers = ['mirror', 'fire', '27', 'candle flame', 'footstep']
+        matcher = AnswerMatcher(answers)
+        attempts = [
+            typo(rng.choice(answers), rng) for _ in range(options['attempts'])
+        ]
+
+        self.rate('answer verdicts (AnswerMatcher)', matcher.matches, attempts)
+        self.rate(
+            'answer verdicts (token_sort_ratio loop)',
+            lambda attempt: any(fuzz.token_sort_ratio(answer, attempt) > 90 for answer in answers),
+            attempts,
+        )
+
+        for size in options['elements']:
+            names = [
+                '_'.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(2))
+                for _ in range(size)
+            ]
+            inputs = [typo(rng.choice(names), rng) for _ in range(max(100, options['attempts'] // size))]
+            self.rate(
+                f'full scan ({size} elements)',
+                lambda attempt: fuzzy_element_match(attempt, names),
+                inputs,
+            )
+            index = ElementIndex(names)
+            self.rate(f'ElementIndex ({size} elements)', index.resolve, inputs)
@@ -0,0 +1,101 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.models import Answer, Element
+from chatbot.text import PIPELINE_EXCLUDES, lemmatize, load_nlp, normalize_string
+from ._bench import percentile, rss_kb, run_in_child
+
+# Typical player inputs, on top of the stored answers and element names
+SAMPLE_INPUTS = [
+    'hint', 'next', 'mirror', 'a mirror', 'the mirrors', 'fire', 'it is fire',
+    'burning flames', '27', 'twenty seven', 'i think the answer is an echo',
+    'look at the stone mirror', 'inspect the silver key',
+]
+
+
+def measure(mode, corpus, iterations):
+    """Load the pipeline in mode and time it; runs in a child process"""
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    nlp = load_nlp(mode)
+    load_time = time.perf_counter() - start
+    rss_after = rss_kb()
+
+    lemmas = [lemmatize(nlp, text) for text in corpus]
+
+    timings = []
+    for _ in range(iterations):
+        for text in corpus:
+            start = time.perf_counter()
+            lemmatize(nlp, text)
+            timings.append(time.perf_counter() - start)
+
+    return {
+        'mode': mode,
+        'pipes': list(nlp.pipe_names),
+        'load_time': load_time,
+        'rss_kb': rss_after,
+        'rss_delta_kb': rss_after - rss_before,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'lemmas': lemmas,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare spaCy pipeline modes: load time, per-call latency, RSS and lemma parity'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modes', nargs='+', default=list(PIPELINE_EXCLUDES),
+            choices=list(PIPELINE_EXCLUDES),
+            help='Pipeline modes to compare; the first one is the parity baseline'
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=50,
+            help='Passes over the corpus when timing per-call latency'
+        )
+
+    def handle(self, *args, **options):
+        corpus = sorted({
+            normalize_string(text) for text in [
+                *Answer.objects.values_list('answer', flat=True),
+                *Element.objects.values_list('name', flat=True),
+                *SAMPLE_INPUTS,
+            ] if text
+        })
+        self.stdout.write(f"Corpus: {len(corpus)} inputs, {options['iterations']} iterations")
+
+        # Each mode loads in its own child so RSS reflects one worker's copy
+        results = [
+            run_in_child(measure, mode, corpus, options['iterations'])
+            for mode in options['modes']
+        ]
+
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:>11}: load {result['load_time']:.2f}s, "
+                f"RSS {result['rss_kb'] / 1024:.1f} MiB (+{result['rss_delta_kb'] / 1024:.1f} MiB), "
+                f"mean {result['mean_ms']:.3f} ms, p50 {result['p50_ms']:.3f} ms, "
+                f"p95 {result['p95_ms']:.3f} ms, pipes {', '.join(result['pipes'])}"
+            )
+
+        baseline = results[0]
+        for result in results[1:]:
+            mismatches = [
+                (text, expected, actual)
+                for text, expected, actual in zip(corpus, baseline['lemmas'], result['lemmas'])
+                if expected != actual
+            ]
+            if mismatches:
+                self.stdout.write(self.style.ERROR(
+                    f"{result['mode']}: {len(mismatches)} lemma mismatches against {baseline['mode']}"
+                ))
+                for text, expected, actual in mismatches:
+                    self.stdout.write(f"  {text!r}: {expected!r} != {actual!r}")
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{result['mode']}: lemma output identical to {baseline['mode']}"
+                ))
@@ -0,0 +1,122 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import percentile
+
+
+def children(pid):
+    """PIDs whose parent is pid (gunicorn's workers), from /proc"""
+    found = []
+    for entry in Path('/proc').iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / 'stat').read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces; fields resume after its ')'
+        if int(stat.rpartition(')')[2].split()[1]) == pid:
+            found.append(int(entry.name))
+    return found
+
+
+def memory_kb(pid):
+    """(USS, PSS) of a process in KiB: memory only it holds, and its share of the rest"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as rollup:
+        for line in rollup:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return fields['Private_Clean'] + fields['Private_Dirty'], fields['Pss']
+
+
+class Command(BaseCommand):
+    help = (
+        'Start gunicorn with and without preloading and report per-worker '
+        'unique memory (USS) and first-request latency. Linux only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--worker-class', default='uvicorn_worker.UvicornWorker')
+        parser.add_argument('--app', default='escaperoom.asgi')
+        parser.add_argument('--port', type=int, default=8950)
+        parser.add_argument('--path', default='/', help='URL fetched as the first request')
+        parser.add_argument('--timeout', type=float, default=180)
+
+    def handle(self, *args, **options):
+        if not Path('/proc/self/smaps_rollup').exists():
+            raise CommandError('Needs /proc/<pid>/smaps_rollup (Linux 4.14+)')
+
+        for preload in (False, True):
+            boot, latencies, memory = self.measure(preload, options)
+            uss = [kb / 1024 for kb, _ in memory]
+            pss = [kb / 1024 for _, kb in memory]
+            self.stdout.write(
+                f"preload={'on ' if preload else 'off'} "
+                f"boot {boot:6.1f}s  "
+                f"first requests p50 {percentile(latencies, 50):7.0f} ms max {max(latencies):7.0f} ms  "
+                f"worker USS {' '.join(f'{value:.0f}' for value in uss)} MiB "
+                f"(PSS avg {sum(pss) / len(pss):.0f} MiB)"
+            )
+
+    def measure(self, preload, options):
+        url = f"http://127.0.0.1:{options['port']}{options['path']}"
+        command = [
+            sys.executable, '-m', 'gunicorn', options['app'],
+            '--config', str(Path(settings.BASE_DIR) / 'gunicorn.conf.py'),
+            '--workers', str(options['workers']),
+            '--worker-class', options['worker_class'],
+            '--bind', f"127.0.0.1:{options['port']}",
+            '--timeout', str(int(options['timeout'])),
+        ]
+        env = {**os.environ, 'GUNICORN_PRELOAD': 'true' if preload else 'false'}
+
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.wait_until_serving(server, options)
+            boot = time.perf_counter() - start
+
+            # One cold request per worker, all at once; each new connection
+            # lands on whichever worker accepts it first
+            def first_request(_):
+                request_start = time.perf_counter()
+                requests.get(url, timeout=options['timeout'])
+                return (time.perf_counter() - request_start) * 1000
+
+            with ThreadPoolExecutor(options['workers']) as pool:
+                latencies = list(pool.map(first_request, range(options['workers'])))
+            memory = [memory_kb(pid) for pid in children(server.pid)]
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+        return boot, latencies, memory
+
+    def wait_until_serving(self, server, options):
+        deadline = time.monotonic() + options['timeout']
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited with status {server.returncode}')
+            if len(children(server.pid)) >= options['workers']:
+                try:
+                    socket.create_connection(('127.0.0.1', options['port']), timeout=1).close()
+                    return
+                except OSError:
+                    pass
+            time.sleep(0.2)
+        raise CommandError('gunicorn did not start in time')
@@ -0,0 +1,186 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+
+from chatbot.catalog import get_catalog
+from chatbot.jobs import PENDING, job_status
+from chatbot.stubs import StubInferenceServer
+
+from ._bench import percentile
+
+WRONG_ANSWER = 'xylophone quartz'
+
+
+class Command(BaseCommand):
+    help = (
+        'Play full games through / and the chat endpoint with many concurrent '
+        'players, against a stub inference server, and report latency, '
+        'throughput and DB queries per step. Runs on a throwaway database '
+        'seeded by populate_db unless --existing-db is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=8, help='Concurrent players')
+        parser.add_argument('--games', type=int, default=5, help='Games each player plays')
+        parser.add_argument('--path', default='/chatbot/', help='Chat endpoint to post messages to')
+        parser.add_argument('--latency', type=float, default=0.5, help='Stub inference latency in seconds')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of stub responses that are 503s')
+        parser.add_argument('--drain-timeout', type=float, default=60, help='Seconds to wait for image jobs at the end')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--existing-db', action='store_true',
+            help='Play against the configured database; stub images are stored in it'
+        )
+
+    def handle(self, *args, **options):
+        if options['players'] < 1 or options['games'] < 1:
+            raise CommandError('--players and --games must be at least 1')
+
+        # Tokens only ever reach the stub
+        os.environ.update(HF_API_TOKEN='loadtest', HF_TOKEN='loadtest')
+        stub = StubInferenceServer(
+            latency=options['latency'], error_rate=options['error_rate'], seed=options['seed']
+        ).start()
+        old_config = None if options['existing_db'] else self.setup_database()
+        try:
+            # The test client sends requests for host 'testserver'
+            with override_settings(
+                HF_INFERENCE_URL=stub.url, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+            ):
+                if not get_catalog().rooms:
+                    raise CommandError('The catalog is empty; run populate_db first')
+                steps, jobs, elapsed = self.run(options)
+                drained = self.drain(jobs, options['drain_timeout'])
+        finally:
+            if old_config is not None:
+                connections.close_all()
+                teardown_databases(old_config, verbosity=0)
+            stub.stop()
+
+        self.report(steps, elapsed, options)
+        self.stdout.write(
+            f"image jobs: {len(jobs)} started, {len(jobs) - drained} still pending; "
+            f"stub served {stub.requests} requests ({stub.failures} 503s)"
+        )
+
+    def setup_database(self):
+        """Create a scratch test database seeded with the default theme"""
+        database = settings.DATABASES['default']
+        if database['ENGINE'].endswith('sqlite3'):
+            # A file rather than the shared in-memory database, so concurrent
+            # players wait on SQLite's busy timeout instead of failing
+            directory = tempfile.mkdtemp(prefix='loadtest-')
+            database.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'loadtest.sqlite3')
+        old_config = setup_databases(verbosity=0, interactive=False)
+        call_command('populate_db', stdout=open(os.devnull, 'w'))
+        return old_config
+
+    def run(self, options):
+        """Play every game; returns ({step: [(ms, queries, ok)]}, image job IDs, seconds)"""
+        steps = defaultdict(list)
+        jobs = set()
+        lock = threading.Lock()
+
+        def player(number):
+            rng = random.Random(options['seed'] * 1000 + number)
+            try:
+                for _ in range(options['games']):
+                    for step, ms, queries, ok, job in self.play(Client(), options['path'], rng):
+                        with lock:
+                            steps[step].append((ms, queries, ok))
+                            if job:
+                                jobs.add(job)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['players']) as pool:
+            list(pool.map(player, range(options['players'])))
+        return steps, jobs, time.perf_counter() - start
+
+    def play(self, client, path, rng):
+        """
+        One game: start, list themes, pick one, then for every element open
+        it, ask for a hint and answer it (wrongly first, once per game).
+        Yields (step, ms, queries, ok, image job) per request.
+        """
+        def request(step, method, url, data=None, correct=None):
+            start = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                response = method(url, data) if data is not None else method(url)
+            ms = (time.perf_counter() - start) * 1000
+            body = response.json() if response['Content-Type'] == 'application/json' else {}
+            ok = response.status_code == 200 and (
+                correct is None or correct != str(body.get('response')).startswith('Incorrect answer')
+            )
+            return (step, ms, len(queries), ok, body.get('image_job')), body
+
+        def say(step, text, correct=None):
+            return request(step, client.post, path, {'user_input': text}, correct)
+
+        catalog = get_catalog()
+        themes = list(catalog.themes)
+        theme = rng.randrange(len(themes))
+        room = catalog.rooms[themes[theme]]
+
+        yield request('start', client.get, '/')[0]
+        yield say('themes', 'next')[0]
+        result, body = say('theme', str(theme + 1))
+        yield result
+        if body.get('image_job'):
+            yield request('image status', client.get, f"/api/images/{body['image_job']}/")[0]
+
+        for number, (name, element) in enumerate(room['elements'].items()):
+            result, body = say('element', name)
+            yield result
+            if body.get('image_job'):
+                yield request('image status', client.get, f"/api/images/{body['image_job']}/")[0]
+            yield say('hint', 'hint')[0]
+            if number == 0:
+                yield say('wrong answer', WRONG_ANSWER, correct=False)[0]
+            yield say('right answer', rng.choice(element['answers']), correct=True)[0]
+
+    def drain(self, jobs, timeout):
+        """Wait for image jobs to finish; returns how many did"""
+        deadline = time.monotonic() + timeout
+        pending = set(jobs)
+        while pending and time.monotonic() < deadline:
+            pending = {job for job in pending if job_status(job) == PENDING}
+            if pending:
+                time.sleep(0.2)
+        return len(jobs) - len(pending)
+
+    def report(self, steps, elapsed, options):
+        self.stdout.write(
+            f"{options['players']} players x {options['games']} games on {options['path']}, "
+            f"stub latency {options['latency']}s, 503 rate {options['error_rate']:.0%}"
+        )
+        self.stdout.write(
+            f"{'step':>14} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'queries':>8} {'max q':>6}"
+        )
+        total = 0
+        for step, results in steps.items():
+            timings = [ms for ms, _, _ in results]
+            queries = [count for _, count, _ in results]
+            total += len(results)
+            self.stdout.write(
+                f"{step:>14} {len(results):>9} {sum(not ok for _, _, ok in results):>7} "
+                f"{percentile(timings, 50):>8.1f} {percentile(timings, 95):>8.1f} "
+                f"{percentile(timings, 99):>8.1f} {sum(queries) / len(queries):>8.1f} {max(queries):>6}"
+            )
+        games = options['players'] * options['games']
+        self.stdout.write(
+            f"{total} requests in {elapsed:.1f}s: {total / elapsed:.1f} requests/s, {games / elapsed:.2f} games/s"
+        )
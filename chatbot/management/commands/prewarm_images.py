@@ -0,0 +1,116 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from dotenv import load_dotenv
+
+from chatbot.catalog import get_catalog
+from chatbot.images import (
+    ELEMENT_IMAGE_SIZE, IMAGE_PARAMETERS, ROOM_IMAGE_SIZE, element_image_prompt,
+    image_key, image_store, render_image, room_image_prompt,
+)
+from chatbot.text import normalize_string
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate every room and element image into the image store before '
+        'traffic arrives. Stored images are skipped, so an interrupted run '
+        'picks up where it stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Inference requests to run at once'
+        )
+        parser.add_argument('--theme', help='Only pre-warm this theme')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the images that would be generated'
+        )
+
+    def images(self, theme=None):
+        """(label, key, prompt, size) for every image the game can ask for"""
+        catalog = get_catalog()
+        for theme_key, room in catalog.rooms.items():
+            if theme and theme_key != theme:
+                continue
+            prompt = room_image_prompt(room['description'])
+            yield (
+                f"room {room['room_name']}",
+                image_key(prompt, IMAGE_PARAMETERS, ROOM_IMAGE_SIZE),
+                prompt, ROOM_IMAGE_SIZE,
+            )
+            for element_name, element in room['elements'].items():
+                prompt = element_image_prompt(element_name, element['puzzle'])
+                yield (
+                    f"element {element_name}",
+                    image_key(prompt, IMAGE_PARAMETERS, ELEMENT_IMAGE_SIZE),
+                    prompt, ELEMENT_IMAGE_SIZE,
+                )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        load_dotenv()
+        token = os.getenv("HF_TOKEN")
+        theme = options['theme']
+
+        pending = []
+        skipped = 0
+        for label, key, prompt, size in self.images(normalize_string(theme) if theme else None):
+            if image_store.exists(key):
+                skipped += 1
+            else:
+                pending.append((label, key, prompt, size))
+
+        self.stdout.write(f"{len(pending)} to generate, {skipped} already stored")
+        if options['dry_run'] or not pending:
+            for label, key, _, _ in pending:
+                self.stdout.write(f"  {label} ({key[:12]})")
+            return
+
+        def generate(label, key, prompt, size):
+            try:
+                return render_image(key, prompt, size, token)
+            finally:
+                # Pool threads outlive the images they render
+                connections.close_all()
+
+        failures = []
+        generated = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            futures = {executor.submit(generate, *image): image[0] for image in pending}
+            try:
+                for future in as_completed(futures):
+                    label = futures[future]
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        ok = False
+                        label = f"{label}: {e}"
+                    if ok:
+                        generated += 1
+                        self.stdout.write(f"  generated {label}")
+                    else:
+                        failures.append(label)
+                        self.stderr.write(f"  failed {label}")
+            except KeyboardInterrupt:
+                # Finished images are stored; rerunning resumes from here
+                for future in futures:
+                    future.cancel()
+                raise
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"Generated {generated}, failed {len(failures)}, skipped {skipped} "
+            f"in {elapsed:.1f}s ({generated / elapsed:.2f} images/s)"
+        )
+        if failures:
+            raise CommandError(
+                f"{len(failures)} images failed; rerun to retry them: {', '.join(failures)}"
+            )
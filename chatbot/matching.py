@@ -0,0 +1,168 @@
+"""
+Answer and element-name matching on RapidFuzz's C++ scorers.
+
+Stored answers never change between catalog rebuilds, so everything
+is_similar_answer derives from the correct answer (lemmas, word set and the
+token-sorted form the fuzzy scorer compares) is computed once per answer in
+AnswerMatcher. Checking an attempt then costs one preprocessing pass over the
+user's input and one batch scoring call.
+
+Thresholds keep the fuzzywuzzy semantics they were tuned with: scores were
+rounded to an int and compared with a strict '>', so a float score passes
+only if it rounds above the threshold.
+"""
+import bisect
+import re
+from collections import Counter, defaultdict
+
+from rapidfuzz import fuzz, process, utils
+
+ANSWER_THRESHOLD = 90
+ELEMENT_THRESHOLD = 70
+
+# Shorter input words ("the", "at") are filler: they are never taken as the
+# prefix of a name part, and are left out of typo scoring when the input
+# has longer words
+MIN_WORD_LENGTH = 4
+# Element names sharing the most trigrams with the input that get fuzzy-scored
+TYPO_CANDIDATES = 10
+
+
+def token_sort_form(text):
+    """The string token_sort_ratio compares for text"""
+    return " ".join(sorted(utils.default_process(text).split()))
+
+
+def best_match(query, choices, scorer, threshold):
+    """
+    Best (choice, score, key) in one batch call, or None if no choice scores
+    above threshold after rounding
+    """
+    # score_cutoff is inclusive, and round() sends x.5 to even, so nothing
+    # below threshold + 0.5 can round above threshold
+    result = process.extractOne(query, choices, scorer=scorer, score_cutoff=threshold + 0.5)
+    if result and round(result[1]) > threshold:
+        return result
+    return None
+
+
+class CompiledAnswer:
+    __slots__ = ('lowered', 'words', 'sorted_form')
+
+    def __init__(self, processed_answer):
+        self.lowered = processed_answer.lower()
+        self.words = frozenset(self.lowered.split())
+        self.sorted_form = token_sort_form(self.lowered)
+
+
+class AnswerMatcher:
+    """Precompiled matcher for all the accepted answers of one element"""
+
+    def __init__(self, processed_answers):
+        self.answers = tuple(CompiledAnswer(answer) for answer in processed_answers)
+        self.sorted_forms = [answer.sorted_form for answer in self.answers]
+
+    def matches(self, processed_input):
+        lowered = processed_input.lower()
+        words = set(lowered.split())
+        for answer in self.answers:
+            # Exact match, or every word of the answer appears in the input
+            if answer.lowered == lowered or answer.words.issubset(words):
+                return True
+        # Same as token_sort_ratio(answer, input) > 90 for the best answer
+        return best_match(
+            token_sort_form(lowered), self.sorted_forms, fuzz.ratio, ANSWER_THRESHOLD
+        ) is not None
+
+
+def is_similar_answer(correct_answer, user_input):
+    """
+    More precise answer matching with whole word requirements
+    """
+    return AnswerMatcher([correct_answer]).matches(user_input)
+
+
+def fuzzy_element_match(normalized_input, element_names):
+    """Element name that best contains the input, scored with partial_ratio"""
+    result = best_match(normalized_input, list(element_names), fuzz.partial_ratio, ELEMENT_THRESHOLD)
+    return result[0] if result else None
+
+
+def name_parts(text):
+    """Words of text, also splitting element names like stone_mirror on '_'"""
+    return [part for part in re.split(r'[\W_]+', text) if part]
+
+
+def trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ElementIndex:
+    """
+    Lookup tables for resolving player input to one of a room's element names
+    without scoring every element. Tried in order: exact name, a whole input
+    word naming an element, name parts ("mirror" for stone_mirror), fuzzy
+    scoring of the few names that share trigrams with the input, then
+    prefixes of name parts. Filler words are left out of the last two: "the"
+    starts theater_mask, and would otherwise win over a misspelt name later
+    in the input, or match when the input names nothing at all.
+    """
+
+    def __init__(self, element_names):
+        self.names = frozenset(element_names)
+        self.by_part = defaultdict(set)
+        self.by_gram = defaultdict(set)
+        for name in self.names:
+            for part in name_parts(name):
+                self.by_part[part].add(name)
+                for gram in trigrams(part):
+                    self.by_gram[gram].add(name)
+        self.sorted_parts = sorted(self.by_part)
+
+    def resolve(self, normalized_input):
+        if normalized_input in self.names:
+            return normalized_input
+
+        parts = name_parts(normalized_input)
+        joined = "_".join(parts)
+        if joined in self.names:
+            return joined
+
+        named = self.names.intersection(normalized_input.split())
+        if named:
+            return min(named)
+
+        words = [part for part in parts if len(part) >= MIN_WORD_LENGTH]
+        return (
+            self._most_hits(self.by_part.get(part, ()) for part in parts)
+            or (self._fuzzy(" ".join(words), words) if words else self._fuzzy(normalized_input, parts))
+            or self._most_hits(self._prefixed(word) for word in words)
+        )
+
+    def _prefixed(self, prefix):
+        names = set()
+        start = bisect.bisect_left(self.sorted_parts, prefix)
+        for part in self.sorted_parts[start:]:
+            if not part.startswith(prefix):
+                break
+            names |= self.by_part[part]
+        return names
+
+    @staticmethod
+    def _most_hits(name_groups):
+        hits = Counter()
+        for names in name_groups:
+            hits.update(names)
+        if not hits:
+            return None
+        # Most matching parts wins; ties go to the alphabetically first name
+        return min(hits, key=lambda name: (-hits[name], name))
+
+    def _fuzzy(self, normalized_input, parts):
+        shared = Counter()
+        for part in parts:
+            for gram in trigrams(part):
+                shared.update(self.by_gram.get(gram, ()))
+        candidates = [name for name, _ in shared.most_common(TYPO_CANDIDATES)]
+        return fuzzy_element_match(normalized_input, candidates) if candidates else None
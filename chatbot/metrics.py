@@ -0,0 +1,155 @@
+"""
+Request phase timing.
+
+Hot-path phases of a chat message (catalog snapshot, session read, spaCy
+preprocessing, answer and element matching, the session write, image job
+submission) are wrapped in `timed(phase)`. Each timing goes to a
+per-process histogram, and, during a request, into that request's
+breakdown, which ServerTimingMiddleware sends back as a Server-Timing
+header. `render()` writes the histograms in the Prometheus text format for
+the /metrics endpoint.
+
+Histograms are kept per process: under gunicorn a scrape reads whichever
+worker answers it.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .text import preprocess_cache_stats
+
+# Upper bounds in seconds, from a cached lookup to a slow inference call
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Phase -> accumulated milliseconds for the request being handled, if any
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label value, thread safe"""
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # Per-bucket counts, then the sum of observations
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {value: (list(counts), total) for value, (counts, total) in self._series.items()}
+        for value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+phase_seconds = Histogram(
+    'chatbot_phase_duration_seconds', 'Time spent in each phase of handling a message.', 'phase'
+)
+request_seconds = Histogram(
+    'chatbot_request_duration_seconds', 'Time to produce a response, per view.', 'view'
+)
+
+
+def observe(phase, seconds):
+    """Record a phase timing, and add it to the current request's breakdown"""
+    phase_seconds.observe(phase, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds * 1000
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start)
+
+
+def server_timing(timings, total_ms):
+    """Server-Timing header value for a request's phase breakdown"""
+    metrics = [f"{phase};dur={ms:.1f}" for phase, ms in timings.items()]
+    metrics.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(metrics)
+
+
+class ServerTimingMiddleware:
+    """
+    Collect the phases timed while handling a request into a Server-Timing
+    header, and observe the request's duration per view. Goes first in
+    MIDDLEWARE, so `total` includes the other middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        timings = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings, start)
+
+    def finish(self, request, response, timings, start):
+        elapsed = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        request_seconds.observe(match.url_name if match and match.url_name else 'unmatched', elapsed)
+        response['Server-Timing'] = server_timing(timings, elapsed * 1000)
+        return response
+
+
+def render():
+    """Every metric of this process in the Prometheus text format"""
+    lines = phase_seconds.render() + request_seconds.render()
+    stats = preprocess_cache_stats()
+    for counter in ('hits', 'misses', 'evictions'):
+        name = f"chatbot_preprocess_cache_{counter}_total"
+        lines += [f"# TYPE {name} counter", f"{name} {stats[counter]}"]
+    lines += ["# TYPE chatbot_preprocess_cache_size gauge", f"chatbot_preprocess_cache_size {stats['size']}"]
+    return "\n".join(lines) + "\n"
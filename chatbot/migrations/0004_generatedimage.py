@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_usergamesession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('data', models.BinaryField()),
+                ('content_type', models.CharField(default='image/png', max_length=50)),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_generatedimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedimage',
+            name='rendition',
+            field=models.CharField(default='full', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='generatedimage',
+            name='key',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='generatedimage',
+            constraint=models.UniqueConstraint(fields=('key', 'rendition'), name='unique_image_rendition'),
+        ),
+    ]
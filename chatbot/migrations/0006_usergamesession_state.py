@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_generatedimage_rendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usergamesession',
+            name='state',
+            field=models.JSONField(default=dict),
+        ),
+    ]
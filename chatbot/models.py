@@ -1,5 +1,6 @@
 from django.db import models
 from django.core.validators import MinLengthValidator
+from django.utils import timezone
 
 class Theme(models.Model):
     name = models.CharField(
@@ -85,6 +86,8 @@ class UserGameSession(models.Model):
     current_theme = models.CharField(max_length=100, null=True, blank=True)
     score = models.IntegerField(default=0)
     lives = models.IntegerField(default=3)
+    # The rest of PuzzleLogic.to_dict(): current element, game flags, timers
+    state = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
     last_active = models.DateTimeField(auto_now=True)
 
@@ -93,3 +96,34 @@ class UserGameSession(models.Model):
 
     def __str__(self):
         return f"Session {self.session_id}"
+
+
+class GeneratedImage(models.Model):
+    """Encoded output of the image model, addressed by a hash of its request"""
+    key = models.CharField(max_length=64)
+    rendition = models.CharField(max_length=20, default='full')
+    data = models.BinaryField()
+    content_type = models.CharField(max_length=50, default='image/png')
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'rendition'], name='unique_image_rendition')
+        ]
+
+    def __str__(self):
+        return f"Image {self.key[:12]} ({self.rendition})"
+
+
+class CatalogVersion(models.Model):
+    """
+    The single row holding the catalog's version stamp. It lives in the
+    database because that is the one store every worker and node shares.
+    """
+    version = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Catalog {self.version}"
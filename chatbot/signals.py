@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import invalidate_catalog
+from .models import Theme, Room, Element, Answer
+
+
+@receiver([post_save, post_delete], sender=Theme)
+@receiver([post_save, post_delete], sender=Room)
+@receiver([post_save, post_delete], sender=Element)
+@receiver([post_save, post_delete], sender=Answer)
+def catalog_changed(sender, **kwargs):
+    # QuerySet.update() and bulk_create() bypass these signals; call
+    # invalidate_catalog() directly after bulk edits.
+    invalidate_catalog()
@@ -0,0 +1,224 @@
+"""
+Unit of work for a player's persisted game state.
+
+UserGameSession is the single store of a player's game: solved elements,
+score, lives and theme in columns, the rest of PuzzleLogic's state in
+`state`. It is read once when a message arrives; the state after handling
+it is staged here and the fields that changed are written in one UPDATE.
+
+With GAME_STATE_BACKEND = 'cache' hot sessions are served from the Django
+cache instead, and changed sessions are written to the database behind the
+request: a per-process thread persists them in batches at least every
+GAME_STATE_FLUSH_INTERVAL seconds, and once more when the process exits.
+The cache must be shared by every worker (Redis), or workers would each see
+their own copy of a game.
+"""
+import atexit
+import copy
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+
+from .models import UserGameSession
+
+logger = logging.getLogger(__name__)
+
+# Persisted game fields; the rest of the row is bookkeeping
+GAME_FIELDS = ('solved_elements', 'current_theme', 'score', 'lives', 'state')
+
+
+def _new_session():
+    return {
+        'solved_elements': {},
+        'score': 0,
+        'lives': 3,
+        'state': {}
+    }
+
+
+def cache_backend_enabled():
+    return getattr(settings, 'GAME_STATE_BACKEND', 'db') == 'cache'
+
+
+def _cache_key(session_id):
+    return f'chatbot:game-session:{session_id}'
+
+
+def _cache_timeout():
+    return getattr(settings, 'GAME_STATE_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+class GameSessionUnitOfWork:
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.session = None
+        self._loaded = {}
+        self._changes = {}
+
+    def load(self):
+        """Read (or create) the session row; the only read per message"""
+        cached = cache.get(_cache_key(self.session_id)) if cache_backend_enabled() else None
+        if cached is not None:
+            return self._loaded_from(UserGameSession(session_id=self.session_id, **copy.deepcopy(cached)))
+
+        session, _ = UserGameSession.objects.get_or_create(
+            session_id=self.session_id, defaults=_new_session()
+        )
+        self._loaded_from(session)
+        if cache_backend_enabled():
+            cache.set(_cache_key(self.session_id), self._loaded, _cache_timeout())
+        return session
+
+    async def aload(self):
+        """load() for async views, through the async cache and ORM APIs"""
+        cached = await cache.aget(_cache_key(self.session_id)) if cache_backend_enabled() else None
+        if cached is not None:
+            return self._loaded_from(UserGameSession(session_id=self.session_id, **copy.deepcopy(cached)))
+
+        session, _ = await UserGameSession.objects.aget_or_create(
+            session_id=self.session_id, defaults=_new_session()
+        )
+        self._loaded_from(session)
+        if cache_backend_enabled():
+            await cache.aset(_cache_key(self.session_id), self._loaded, _cache_timeout())
+        return session
+
+    def _loaded_from(self, session):
+        self.session = session
+        # Copied, since callers mutate the JSON fields in place
+        self._loaded = {
+            field: copy.deepcopy(getattr(session, field))
+            for field in ('id',) + GAME_FIELDS
+        }
+        return session
+
+    def update(self, **fields):
+        """Stage field changes; later values for a field replace earlier ones"""
+        self._changes.update(fields)
+
+    def _take_changes(self):
+        changes = {
+            field: value for field, value in self._changes.items()
+            if field not in self._loaded or self._loaded[field] != value
+        }
+        self._changes = {}
+        self._loaded.update(copy.deepcopy(changes))
+        return changes
+
+    def flush(self):
+        """Write every staged change in one UPDATE; a no-op when nothing changed"""
+        changes = self._take_changes()
+        if not changes:
+            return False
+
+        if cache_backend_enabled() and self._loaded.get('id'):
+            cache.set(_cache_key(self.session_id), self._loaded, _cache_timeout())
+            write_behind.add(self.session_id, self._loaded)
+            return True
+
+        try:
+            UserGameSession.objects.filter(session_id=self.session_id).update(
+                last_active=timezone.now(), **changes
+            )
+        except Exception as e:
+            logger.error(f"Error updating session: {e}")
+            return False
+        return True
+
+    async def aflush(self):
+        """flush() for async views"""
+        changes = self._take_changes()
+        if not changes:
+            return False
+
+        if cache_backend_enabled() and self._loaded.get('id'):
+            await cache.aset(_cache_key(self.session_id), self._loaded, _cache_timeout())
+            write_behind.add(self.session_id, self._loaded)
+            return True
+
+        try:
+            await UserGameSession.objects.filter(session_id=self.session_id).aupdate(
+                last_active=timezone.now(), **changes
+            )
+        except Exception as e:
+            logger.error(f"Error updating session: {e}")
+            return False
+        return True
+
+
+class WriteBehind:
+    """
+    Batches changed sessions and persists them off the request path. Only the
+    latest state of a session is written: it is re-read from the shared cache
+    at flush time, so whichever worker flushes last still writes the newest
+    state, and the queued snapshot is only a fallback for evicted entries.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, session_id, fields):
+        with self._lock:
+            self._pending[session_id] = copy.deepcopy(fields)
+            full = len(self._pending) >= getattr(settings, 'GAME_STATE_FLUSH_BATCH', 100)
+            self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so a forked worker starts its own
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='game-state-write-behind', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(getattr(settings, 'GAME_STATE_FLUSH_INTERVAL', 2.0))
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        """Persist every pending session in one batch; returns how many"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        latest = cache.get_many([_cache_key(session_id) for session_id in pending])
+        now = timezone.now()
+        sessions = []
+        for session_id, fields in pending.items():
+            fields = latest.get(_cache_key(session_id), fields)
+            sessions.append(UserGameSession(session_id=session_id, last_active=now, **fields))
+        try:
+            UserGameSession.objects.bulk_update(sessions, GAME_FIELDS + ('last_active',))
+        except Exception as e:
+            logger.error(f"Error persisting {len(sessions)} game sessions: {e}")
+            with self._lock:
+                # Retry on the next flush unless a newer change is queued
+                for session_id, fields in pending.items():
+                    self._pending.setdefault(session_id, fields)
+            return 0
+        return len(sessions)
+
+
+write_behind = WriteBehind()
+
+# Gunicorn and runserver exit workers through sys.exit, which runs this
+atexit.register(write_behind.flush)
@@ -0,0 +1,95 @@
+"""
+Local stand-in for the Hugging Face inference API.
+
+Answers every POST with a generated PNG after a fixed latency, and can fail a
+share of requests with 503 (optionally with Retry-After) the way the real API
+does while a model loads.
+Point HF_INFERENCE_URL at `server.url` to exercise image generation without
+network access or an API token.
+"""
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+def _png(size=(1024, 1024)):
+    buffered = io.BytesIO()
+    Image.new("RGB", size, (40, 40, 60)).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+class StubInferenceServer:
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=None, port=0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._image = _png()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    fail = stub._random.random() < stub.error_rate
+                    if fail:
+                        stub.failures += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if fail:
+                    body = b'{"error": "Model is currently loading"}'
+                    self.send_response(503)
+                    self.send_header("Content-Type", "application/json")
+                    if stub.retry_after is not None:
+                        self.send_header("Retry-After", str(stub.retry_after))
+                else:
+                    body = stub._image
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stub-inference", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,3 +1,885 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import logging.config
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from . import catalog
+from .encoding import encode_renditions
+from .images import (
+    ELEMENT_IMAGE_SIZE, IMAGE_PARAMETERS, ROOM_IMAGE_SIZE, element_image_prompt, image_key,
+    image_store, room_image_prompt,
+)
+from .inference import CircuitBreaker, CircuitOpenError, InferenceClient, InferenceError, retry_after_seconds
+from .matching import AnswerMatcher, ElementIndex, fuzzy_element_match, is_similar_answer
+from .models import Answer, CatalogVersion, Element, GeneratedImage, Room, Theme, UserGameSession
+from .jobs import (
+    FAILED, PENDING, READY, ajob_status, await_job, job_status, submit_image_job, submit_image_job_async,
+)
+from .log import JsonFormatter, QueueingHandler
+from .lru import LRUCache
+from .state import write_behind
+from .stubs import StubInferenceServer
+from . import metrics
+from . import text
+from . import warmup
+
+
+class GameFixturesMixin:
+    """The room most game tests play, and a stub inference server"""
+
+    def create_clockwork_vault(self):
+        """Clockwork Vault's Gear Room: pendulum (answer 'time') and cog ('gear')"""
+        theme = Theme.objects.create(name='Clockwork Vault')
+        room = Room.objects.create(theme=theme, name='Gear Room', description='Ticking walls.')
+        for name, answer in (('pendulum', 'time'), ('cog', 'gear')):
+            element = Element.objects.create(room=room, name=name, puzzle=f'What drives the {name}?', hint='Listen.')
+            Answer.objects.create(element=element, answer=answer)
+        return room
+
+    def store_images(self, room):
+        """
+        Store the room's images, so playing it starts no generation jobs. Keys
+        include the inference URL, so call this after start_stub_inference().
+        """
+        image = encode_renditions(Image.new('RGB', (64, 64)), (32, 32))
+        image_store.put(image_key(room_image_prompt(room.description), IMAGE_PARAMETERS, ROOM_IMAGE_SIZE), image)
+        for element in room.elements.all():
+            prompt = element_image_prompt(element.name, element.puzzle)
+            image_store.put(image_key(prompt, IMAGE_PARAMETERS, ELEMENT_IMAGE_SIZE), image)
+
+    def start_stub_inference(self, **options):
+        """Serve images from a StubInferenceServer for the rest of the test"""
+        server = StubInferenceServer(**options).start()
+        self.addCleanup(server.stop)
+        settings_override = override_settings(HF_INFERENCE_URL=server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return server
+
+
+class AnswerMatchingParityTests(SimpleTestCase):
+    """Verdicts recorded from the fuzzywuzzy implementation (token_sort_ratio > 90)"""
+
+    # (processed answer, processed attempt, accepted); comments give the fuzzywuzzy score
+    CASES = [
+        ('27', '27', True),
+        ('mirror', 'mirror', True),
+        ('candle flame', 'flame candle', True),
+        ('fire', 'the fire be hot', True),
+        ('27', '72', False),
+        ('mirror', '', False),
+        ('mirror', 'mirwrpor', False),  # 86
+        ('mirror', 'mierrors', False),  # 86
+        ('mirror', 'mirrori', True),  # 92
+        ('mirror', 'mierror', True),  # 92
+        ('fire', 'fwire', False),  # 89
+        ('fire', 'ire', False),  # 86
+        ('fire', 'fires', False),  # 89
+        ('echo', 'echpo', False),  # 89
+        ('echo', 'cho', False),  # 86
+        ('shadow', 'shado', True),  # 91
+        ('shadow', 'shpadow', True),  # 92
+        ('candle flame', 'canddle flame', True),  # 96
+        ('candle flame', 'cadnle flame', True),  # 92
+        ('candle flame', 'candl falme', False),  # 87
+        ('keyboard', 'keyboar', True),  # 93
+        ('keyboard', 'kmeyoard', False),  # 88
+        ('silence', 'sielnce', False),  # 86
+        ('silence', 'silences', True),  # 93
+        ('footstep', 'footstpe', False),  # 88
+        ('footstep', 'fotstep', True),  # 93
+    ]
+
+    def test_is_similar_answer_verdicts(self):
+        for answer, attempt, accepted in self.CASES:
+            with self.subTest(answer=answer, attempt=attempt):
+                self.assertEqual(is_similar_answer(answer, attempt), accepted)
+
+    def test_matcher_accepts_if_any_answer_does(self):
+        matcher = AnswerMatcher(['fire', 'flame'])
+        self.assertTrue(matcher.matches('flame'))
+        self.assertTrue(matcher.matches('fires flame'))
+        self.assertFalse(matcher.matches('water'))
+
+
+class ElementMatchingParityTests(SimpleTestCase):
+    """Verdicts recorded from the fuzzywuzzy implementation (partial_ratio > 70)"""
+
+    ELEMENTS = ['glowing_inscription', 'silver_key', 'stone_mirror']
+
+    CASES = [
+        ('mirror', 'stone_mirror'),
+        ('key', 'silver_key'),
+        ('inscription', 'glowing_inscription'),
+        ('stone', 'stone_mirror'),
+        ('glow', 'glowing_inscription'),
+        ('mirorr', 'stone_mirror'),  # 83
+        ('sliver key', 'silver_key'),  # 80
+        ('inscripton', 'glowing_inscription'),  # 90
+        ('stone mirror', 'stone_mirror'),  # 92
+        ('silver_key please', 'silver_key'),
+        ('mir', 'stone_mirror'),
+        ('look at the key', None),  # 42
+        ('hello there', None),  # 42
+        ('kye', None),  # 67
+        ('door', None),  # 50
+        ('answer', None),  # 50
+        ('xyz', None),
+    ]
+
+    # fuzzywuzzy's partial_ratio compared difflib's matching blocks, which can
+    # miss the best alignment; RapidFuzz finds it, so these now clear 70.
+    DIVERGENT = [
+        ('the mirror', 'stone_mirror'),  # fuzzywuzzy 70, RapidFuzz 77.8
+        ('eky', 'silver_key'),  # fuzzywuzzy 67, RapidFuzz 80
+    ]
+
+    def test_fuzzy_element_match_verdicts(self):
+        for attempt, expected in self.CASES:
+            with self.subTest(attempt=attempt):
+                self.assertEqual(fuzzy_element_match(attempt, self.ELEMENTS), expected)
+
+    def test_known_divergences(self):
+        for attempt, expected in self.DIVERGENT:
+            with self.subTest(attempt=attempt):
+                self.assertEqual(fuzzy_element_match(attempt, self.ELEMENTS), expected)
+
+
+class ElementIndexTests(SimpleTestCase):
+    ELEMENTS = [
+        'glowing_inscription', 'silver_key', 'stone_mirror', 'stone_door',
+        'chest', 'theater_mask', 'lantern', 'anchor',
+    ]
+
+    def setUp(self):
+        self.index = ElementIndex(self.ELEMENTS)
+
+    def test_resolves_like_the_fuzzy_scan(self):
+        index = ElementIndex(ElementMatchingParityTests.ELEMENTS)
+        for attempt, expected in ElementMatchingParityTests.CASES:
+            if expected is None:
+                continue
+            with self.subTest(attempt=attempt):
+                self.assertEqual(index.resolve(attempt), expected)
+
+    def test_lookup_stages(self):
+        cases = [
+            ('stone_mirror', 'stone_mirror'),  # exact
+            ('stone mirror', 'stone_mirror'),  # joined words
+            ('look at the key', 'silver_key'),  # name part
+            ('stone', 'stone_door'),  # ambiguous part, alphabetical
+            ('the stone mirror', 'stone_mirror'),  # most parts wins
+            ('insc', 'glowing_inscription'),  # prefix
+            ('glowng', 'glowing_inscription'),  # typo
+            ('open the lantrn', 'lantern'),  # typo before the prefix "the"
+            ('tell me about the ancor', 'anchor'),
+            ('look at the chst', 'chest'),
+            ('thea', 'theater_mask'),  # prefix
+            ('use the rope', None),  # "the" is no prefix
+            ('inspect the painting', None),
+            ('the answer', None),
+            ('hello there', None),
+        ]
+        for attempt, expected in cases:
+            with self.subTest(attempt=attempt):
+                self.assertEqual(self.index.resolve(attempt), expected)
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used_first(self):
+        cache = LRUCache(2)
+        cache.set('fire', 1)
+        cache.set('water', 2)
+        self.assertEqual(cache.get('fire'), 1)
+        cache.set('earth', 3)
+        self.assertIsNone(cache.get('water'))
+        self.assertEqual((cache.get('fire'), cache.get('earth')), (1, 3))
+
+    def test_counts_hits_misses_and_evictions(self):
+        cache = LRUCache(2)
+        computed = []
+        for key in ('a', 'b', 'a', 'c', 'b'):
+            cache.get_or_compute(key, lambda key: computed.append(key) or key.upper())
+        self.assertEqual(computed, ['a', 'b', 'c', 'b'])
+        stats = cache.stats()
+        self.assertEqual(
+            (stats['hits'], stats['misses'], stats['evictions'], stats['size'], stats['maxsize']),
+            (1, 4, 2, 2, 2),
+        )
+        self.assertEqual(stats['hit_rate'], 0.2)
+
+        cache.clear()
+        self.assertEqual(cache.stats()['hits'] + cache.stats()['size'], 0)
+
+    def test_preprocessing_is_memoized_on_normalized_text(self):
+        text._preprocess_cache.clear()
+        self.addCleanup(text._preprocess_cache.clear)
+        self.assertEqual(text.preprocess_text('Fire '), text.preprocess_text('fire'))
+        stats = text.preprocess_cache_stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['size']), (1, 1, 1))
+
+
+class CatalogVersionTests(TransactionTestCase):
+
+    def setUp(self):
+        theme = Theme.objects.create(name='Clockwork Vault')
+        self.room = Room.objects.create(theme=theme, name='Gear Room', description='Ticking walls.')
+        Element.objects.create(room=self.room, name='cog', puzzle='What turns?', hint='Listen.')
+
+    def element_names(self):
+        return set(catalog.get_catalog().rooms['clockwork vault']['elements'])
+
+    def test_edits_invalidate_the_snapshot(self):
+        self.assertEqual(self.element_names(), {'cog'})
+        element = Element.objects.create(room=self.room, name='pendulum', puzzle='What swings?', hint='Tick.')
+        self.assertEqual(self.element_names(), {'cog', 'pendulum'})
+        element.delete()
+        self.assertEqual(self.element_names(), {'cog'})
+
+    def test_rebuilds_leave_the_preprocessing_cache_alone(self):
+        Answer.objects.create(element=Element.objects.get(), answer='Gears')
+        text._preprocess_cache.clear()
+        self.addCleanup(text._preprocess_cache.clear)
+        matcher = catalog.get_catalog().rooms['clockwork vault']['elements']['cog']['matcher']
+        self.assertTrue(matcher.matches(text.preprocess_text('gear')))
+        self.assertEqual(text.preprocess_cache_stats()['misses'], 1)
+        self.assertEqual(text.preprocess_cache_stats()['size'], 1)
+
+    @override_settings(CATALOG_VERSION_CHECK_INTERVAL=60)
+    def test_steady_state_issues_no_queries(self):
+        catalog.get_catalog()
+        with self.assertNumQueries(0):
+            catalog.get_catalog()
+
+    def test_another_workers_edit_is_seen_through_the_database(self):
+        snapshot = catalog.get_catalog()
+        # What another process's invalidate_catalog() leaves behind: a new
+        # stamp in the database, while this process still holds its snapshot
+        Element.objects.bulk_create([Element(room=self.room, name='spring', puzzle='What coils?', hint='Wind.')])
+        CatalogVersion.objects.filter(pk=1).update(version='other-worker')
+
+        with override_settings(CATALOG_VERSION_CHECK_INTERVAL=60):
+            self.assertIs(catalog.get_catalog(), snapshot)
+        with override_settings(CATALOG_VERSION_CHECK_INTERVAL=0):
+            self.assertEqual(self.element_names(), {'cog', 'spring'})
+            with self.assertNumQueries(1):
+                catalog.get_catalog()
+
+
+class PrewarmImagesTests(GameFixturesMixin, TransactionTestCase):
+    """prewarm_images against a local stub of the inference API"""
+
+    def setUp(self):
+        theme = Theme.objects.create(name='Sunken Archive')
+        room = Room.objects.create(theme=theme, name='Reading Room', description='Flooded shelves.')
+        for name in ('ledger', 'lantern', 'brass_lock'):
+            Element.objects.create(room=room, name=name, puzzle=f'Puzzle for {name}', hint='None')
+        self.server = self.start_stub_inference()
+
+    def prewarm(self, *args):
+        # One writer: pool threads writing the in-memory test database at
+        # once fail with "database table is locked"
+        out = StringIO()
+        call_command('prewarm_images', '--concurrency', '1', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_generates_room_and_element_images(self):
+        output = self.prewarm()
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(GeneratedImage.objects.filter(rendition='full').count(), 4)
+        self.assertIn('Generated 4, failed 0, skipped 0', output)
+
+    def test_rerun_skips_stored_images(self):
+        self.prewarm()
+        output = self.prewarm()
+        self.assertEqual(self.server.requests, 4)
+        self.assertIn('0 to generate, 4 already stored', output)
+
+    def test_concurrency_must_be_positive(self):
+        with self.assertRaisesMessage(CommandError, '--concurrency must be at least 1'):
+            self.prewarm('--concurrency', '0')
+        self.assertEqual(self.server.requests, 0)
+
+
+class InferenceClientTests(SimpleTestCase):
+    """Retries, Retry-After and the circuit breaker against the stub server"""
+
+    def inference_client(self, retries=2, threshold=2):
+        return InferenceClient(
+            max_retries=retries, backoff=0.0,
+            breaker=CircuitBreaker(failure_threshold=threshold, reset_timeout=60),
+        )
+
+    def test_returns_image_over_a_reused_connection(self):
+        with StubInferenceServer() as server:
+            client = self.inference_client()
+            for _ in range(3):
+                self.assertTrue(client.post(server.url, 'token', {}).startswith(b'\x89PNG'))
+        self.assertEqual(server.requests, 3)
+
+    def test_retries_then_gives_up(self):
+        with StubInferenceServer(error_rate=1.0) as server:
+            with self.assertRaises(InferenceError):
+                self.inference_client(retries=2).post(server.url, 'token', {})
+        self.assertEqual(server.requests, 3)
+
+    def test_breaker_fails_fast_while_open(self):
+        with StubInferenceServer(error_rate=1.0) as server:
+            client = self.inference_client(retries=0, threshold=2)
+            for _ in range(2):
+                with self.assertRaises(InferenceError):
+                    client.post(server.url, 'token', {})
+            with self.assertRaises(CircuitOpenError):
+                client.post(server.url, 'token', {})
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retry_after_is_honoured(self):
+        client = InferenceClient(backoff=100.0, max_backoff=5.0)
+        with StubInferenceServer(error_rate=1.0, retry_after=2) as server:
+            response = client.session.post(server.url, json={})
+        self.assertEqual(client.retry_delay(0, response), 2.0)
+        self.assertLessEqual(client.retry_delay(6), 5.0)
+        self.assertEqual(retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(retry_after_seconds('soon'))
+
+
+@override_settings(IMAGE_FORMAT='WEBP', IMAGE_RENDITIONS={'small': 0.5})
+class GeneratedImageTests(TestCase):
+
+    def setUp(self):
+        self.key = 'a' * 64
+        image_store.put(self.key, encode_renditions(Image.new('RGB', (1024, 1024)), (800, 600)))
+
+    def test_renditions_are_scaled_and_encoded(self):
+        renditions = encode_renditions(Image.new('RGB', (1024, 768)), (800, 600), format='JPEG')
+        self.assertEqual([name for name, _, _ in renditions], ['full', 'small'])
+        sizes = [Image.open(BytesIO(data)).size for _, data, _ in renditions]
+        self.assertEqual(sizes, [(800, 600), (400, 300)])
+        self.assertEqual({content_type for _, _, content_type in renditions}, {'image/jpeg'})
+
+    def test_serves_each_rendition_with_validators(self):
+        for url, width in ((f'/images/{self.key}', 600), (f'/images/{self.key}/small', 300)):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            self.assertEqual(Image.open(BytesIO(response.content)).width, width)
+            self.assertIn('immutable', response['Cache-Control'])
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+    def test_eviction_by_another_worker_is_noticed_when_served(self):
+        self.assertTrue(image_store.exists(self.key))
+        GeneratedImage.objects.filter(key=self.key).delete()
+        # Still memoized until a request finds it gone
+        self.assertTrue(image_store.exists(self.key))
+        self.assertEqual(self.client.get(f'/images/{self.key}').status_code, 404)
+        self.assertFalse(image_store.exists(self.key))
+
+    def test_unknown_rendition_is_not_found(self):
+        self.assertEqual(self.client.get(f'/images/{self.key}/huge').status_code, 404)
+
+    def test_images_without_a_rendition_serve_the_full_one(self):
+        # Rows stored before renditions existed only have 'full'
+        key = '1' * 64
+        full, _ = encode_renditions(Image.new('RGB', (1024, 1024)), (800, 600))
+        image_store.put(key, [full])
+        response = self.client.get(f'/images/{key}/small')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(response.content)).width, 600)
+        self.assertIn('-full-', response['ETag'])
+
+
+class ImageJobTests(TestCase):
+
+    def wait_for(self, job):
+        deadline = time.monotonic() + 10
+        while job_status(job) == PENDING and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return job_status(job)
+
+    def test_job_is_pending_until_generate_succeeds(self):
+        release = threading.Event()
+        job = submit_image_job('b' * 64, release.wait, 10)
+        self.assertEqual(job, 'b' * 64)
+        self.assertEqual(job_status(job), PENDING)
+        self.assertEqual(self.client.get(f'/api/images/{job}/').json(), {'status': PENDING})
+
+        release.set()
+        self.assertEqual(self.wait_for(job), READY)
+        response = self.client.get(f'/api/images/{job}/').json()
+        self.assertEqual(response['status'], READY)
+        self.assertEqual(response['image_url'], f'/images/{job}')
+
+    def test_raising_generate_fails_the_job(self):
+        def generate():
+            raise RuntimeError('inference down')
+
+        with self.assertLogs('chatbot.jobs', 'ERROR'):
+            job = submit_image_job('c' * 64, generate)
+            self.assertEqual(self.wait_for(job), FAILED)
+        self.assertEqual(self.client.get(f'/api/images/{job}/').json(), {'status': FAILED})
+
+    def test_falsy_generate_fails_the_job(self):
+        job = submit_image_job('d' * 64, lambda: None)
+        self.assertEqual(self.wait_for(job), FAILED)
+
+    def test_known_states_are_read_from_the_cache(self):
+        job = submit_image_job('e' * 64, lambda: True)
+        self.wait_for(job)
+        with self.assertNumQueries(0):
+            self.assertEqual(job_status(job), READY)
+
+    @override_settings(IMAGE_STREAM_POLL_INTERVAL=30)
+    async def test_await_job_wakes_when_a_job_here_finishes(self):
+        release = threading.Event()
+        job = await sync_to_async(submit_image_job)('f' * 64, release.wait, 10)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.1, release.set)
+        start = loop.time()
+        self.assertEqual(await await_job(job, 10), READY)
+        self.assertLess(loop.time() - start, 5)
+
+    async def test_await_job_times_out_on_unknown_jobs(self):
+        self.assertEqual(await await_job('0' * 64, 0.05), PENDING)
+
+
+class GameSessionWriteTests(GameFixturesMixin, TransactionTestCase):
+    """Each chat message reads the player's game session once and writes it at most once"""
+
+    def setUp(self):
+        room = self.create_clockwork_vault()
+        self.start_stub_inference()
+        # Image jobs would outlive the test, and the stub
+        self.store_images(room)
+        self.client.get('/')
+
+    def send(self, message):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/chatbot/', {'user_input': message})
+        self.assertEqual(response.status_code, 200)
+        session_queries = [
+            query['sql'] for query in queries.captured_queries
+            if 'chatbot_usergamesession' in query['sql']
+        ]
+        reads = [sql for sql in session_queries if sql.startswith('SELECT')]
+        writes = [sql for sql in session_queries if not sql.startswith('SELECT')]
+        self.assertEqual(len(reads), 1, session_queries)
+        self.assertLessEqual(len(writes), 1, session_queries)
+        # UserGameSession is the only store of game state
+        self.assertFalse([
+            query for query in queries.captured_queries if 'django_session' in query['sql']
+        ])
+        return response.json(), writes
+
+    def test_starting_a_game_writes_no_catalog_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/')
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'chatbot_element' in query['sql'] and not query['sql'].startswith('SELECT')
+        ])
+
+    def test_one_read_and_at_most_one_write_per_message(self):
+        self.send('next')
+        self.send('1')
+        self.send('pendulum')
+
+        _, writes = self.send('wrong')
+        self.assertEqual(len(writes), 1)
+        data, writes = self.send('time')
+        self.assertIn('Correct', data['response'])
+        self.assertEqual(len(writes), 1)
+
+        session = UserGameSession.objects.get()
+        self.assertEqual(session.score, 10)
+        self.assertEqual(session.lives, 2)
+        self.assertEqual(session.solved_elements, {'clockwork vault': {'pendulum': True}})
+        self.assertIsNone(session.state['current_element'])
+
+        data, writes = self.send('hint')
+        self.assertEqual(writes, [])
+        data, writes = self.send('cog')
+        self.assertEqual(UserGameSession.objects.get().state['current_element'], 'cog')
+
+
+@override_settings(GAME_STATE_BACKEND='cache', GAME_STATE_FLUSH_INTERVAL=60)
+class WriteBehindGameStateTests(GameSessionWriteTests):
+    """Hot sessions come from the cache and reach the database in batches"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(write_behind.flush)
+        super().setUp()
+
+    def session_queries(self, message):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/chatbot/', {'user_input': message})
+        self.assertEqual(response.status_code, 200)
+        return [
+            query['sql'] for query in queries.captured_queries
+            if 'chatbot_usergamesession' in query['sql']
+        ]
+
+    def test_one_read_and_at_most_one_write_per_message(self):
+        for message in ('next', '1', 'pendulum', 'wrong', 'time'):
+            self.assertEqual(self.session_queries(message), [])
+
+        session = UserGameSession.objects.get()
+        self.assertEqual((session.score, session.lives), (0, 3))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(write_behind.flush(), 1)
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        session.refresh_from_db()
+        self.assertEqual((session.score, session.lives), (10, 2))
+        self.assertEqual(session.solved_elements, {'clockwork vault': {'pendulum': True}})
+
+    def test_cache_miss_reads_the_database(self):
+        self.session_queries('next')
+        self.session_queries('1')
+        write_behind.flush()
+        cache.clear()
+        self.assertEqual(len(self.session_queries('pendulum')), 1)
+        self.assertEqual(UserGameSession.objects.get().current_theme, 'clockwork vault')
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=60)
+class QueryBudgetTests(GameFixturesMixin, TransactionTestCase):
+    """
+    Exact database queries per game transition through the views. A change
+    that adds queries to a step fails here; lower the budget when a change
+    removes some. Transaction control (BEGIN, SAVEPOINT...) isn't counted,
+    since only some backends log it.
+    """
+    # A new player's session row is created, then the started game written
+    BUDGETS = {
+        'start': 3,
+        'themes': 1,
+        'theme': 2,
+        'element': 2,
+        'wrong answer': 2,
+        'hint': 2,
+        'right answer': 2,
+        'room completed': 2,
+        'out of lives': 2,
+    }
+
+    def setUp(self):
+        self.store_images(self.create_clockwork_vault())
+        # The first message of a process builds the catalog; budget steady state
+        self.client.get('/')
+        self.client.post('/chatbot/', {'user_input': 'next'})
+
+    def step(self, name, message=None):
+        with CaptureQueriesContext(connection) as queries:
+            if message is None:
+                response = self.client.get('/')
+            else:
+                response = self.client.post('/chatbot/', {'user_input': message})
+        self.assertEqual(response.status_code, 200)
+        statements = [
+            query['sql'] for query in queries.captured_queries
+            if not query['sql'].startswith(('BEGIN', 'COMMIT', 'SAVEPOINT', 'RELEASE SAVEPOINT'))
+        ]
+        self.assertEqual(len(statements), self.BUDGETS[name], '\n'.join([name] + statements))
+        return response
+
+    def test_full_game(self):
+        self.step('start')
+        self.step('themes', 'next')
+        self.step('theme', '1')
+        self.step('element', 'pendulum')
+        self.step('wrong answer', 'wrong')
+        self.step('hint', 'hint')
+        self.step('right answer', 'time')
+        self.step('element', 'cog')
+        data = self.step('room completed', 'gear').json()
+        self.assertIn('Room completed', data['response'])
+
+    def test_running_out_of_lives(self):
+        for message in ('next', '1', 'cog', 'wrong', 'wrong'):
+            self.client.post('/chatbot/', {'user_input': message})
+        data = self.step('out of lives', 'wrong').json()
+        self.assertTrue(data.get('reload'))
+
+
+@override_settings(GAME_STATE_BACKEND='cache', GAME_STATE_FLUSH_INTERVAL=60)
+class WriteBehindQueryBudgetTests(QueryBudgetTests):
+    """With game state in the cache, only a new player's session touches the database"""
+    BUDGETS = dict.fromkeys(QueryBudgetTests.BUDGETS, 0) | {'start': 2}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(write_behind.flush)
+        super().setUp()
+
+
+class AsyncChatTests(GameFixturesMixin, TransactionTestCase):
+    """The ASGI chat endpoint plays like the sync one and generates images on the job loop"""
+
+    def setUp(self):
+        theme = Theme.objects.create(name='Glass Observatory')
+        room = Room.objects.create(theme=theme, name='Dome', description='Stars overhead.')
+        element = Element.objects.create(room=room, name='telescope', puzzle='What do I show?', hint='Look up.')
+        Answer.objects.create(element=element, answer='stars')
+        self.start_stub_inference(latency=0.2)
+
+    async def send(self, message):
+        response = await self.async_client.post('/async/chatbot/', {'user_input': message})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def test_plays_and_generates_images_asynchronously(self):
+        await self.async_client.get('/')
+        await self.send('next')
+        await self.send('1')
+        data = await self.send('telescope')
+        self.assertIn('What do I show?', data['response'])
+
+        job = data['image_job']
+        for _ in range(50):
+            if await ajob_status(job) == READY:
+                break
+            await asyncio.sleep(0.1)
+        self.assertEqual(await ajob_status(job), READY)
+
+        data = await self.send('stars')
+        self.assertIn('Congratulations', data['response'])
+        session = await UserGameSession.objects.aget()
+        self.assertEqual(session.score, 10)
+        self.assertEqual(session.solved_elements, {'glass observatory': {'telescope': True}})
+
+    async def test_stream_sends_the_reply_then_the_image(self):
+        await self.async_client.get('/')
+        await self.send('next')
+        await self.send('1')
+        response = await self.async_client.post('/chatbot/stream/', {'user_input': 'telescope'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        events = [
+            (block.split('\n')[0].removeprefix('event: '), json.loads(block.split('\n')[1].removeprefix('data: ')))
+            for block in body.strip().split('\n\n') if block.startswith('event:')
+        ]
+        self.assertEqual([event for event, _ in events], ['message', 'image', 'done'])
+        self.assertIn('What do I show?', events[0][1]['response'])
+        self.assertEqual(events[1][1]['image_url'], f"/images/{events[0][1]['image_job']}")
+
+
+class LoadTestCommandTests(GameFixturesMixin, TransactionTestCase):
+
+    def test_reports_every_step_of_a_game(self):
+        self.create_clockwork_vault()
+        out = StringIO()
+        # One player, and image jobs that only store their images once the
+        # games are over: the in-memory test database fails concurrent
+        # writes where a real one would wait for the lock
+        call_command('loadtest', existing_db=True, players=1, games=3, latency=2, stdout=out)
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[2:]}
+        for step in ('start', 'themes', 'theme', 'element', 'hint', 'wrong', 'right'):
+            self.assertIn(step, rows)
+            self.assertEqual(rows[step][-6], '0', f'{step} had errors')
+        self.assertEqual(rows['element'][-7], '6')
+        self.assertEqual(UserGameSession.objects.count(), 3)
+
+
+class MetricsTests(GameFixturesMixin, TransactionTestCase):
+
+    def setUp(self):
+        self.create_clockwork_vault()
+        # Image jobs store what the stub returns from their own threads
+        self.start_stub_inference()
+
+    def test_phases_are_reported_per_request_and_aggregated(self):
+        self.client.get('/')
+        jobs = []
+        for message in ('next', '1', 'cog'):
+            jobs.append(self.client.post('/chatbot/', {'user_input': message}).json().get('image_job'))
+        response = self.client.post('/chatbot/', {'user_input': 'gears'})
+        # Done before the stub stops
+        deadline = time.monotonic() + 10
+        while any(job and job_status(job) == PENDING for job in jobs) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        phases = dict(metric.split(';dur=') for metric in response['Server-Timing'].split(', '))
+        for phase in ('catalog', 'session_read', 'play', 'preprocess', 'match', 'session_write', 'total'):
+            self.assertIn(phase, phases)
+        self.assertGreaterEqual(float(phases['total']), float(phases['play']))
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE chatbot_phase_duration_seconds histogram', body)
+        self.assertIn('chatbot_phase_duration_seconds_bucket{phase="preprocess",le="+Inf"}', body)
+        self.assertIn('chatbot_request_duration_seconds_count{view="chatbot_response"}', body)
+        self.assertIn('chatbot_preprocess_cache_hits_total', body)
+
+    def test_async_image_jobs_stay_out_of_the_request_breakdown(self):
+        async def generate():
+            with metrics.timed('inference'):
+                return True
+
+        timings = {}
+        token = metrics._request_timings.set(timings)
+        try:
+            job = submit_image_job_async('9' * 64, generate)
+        finally:
+            metrics._request_timings.reset(token)
+        deadline = time.monotonic() + 10
+        while job_status(job) == PENDING and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(job_status(job), READY)
+        self.assertEqual(timings, {})
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=60)
+class FetchElementsTests(TestCase):
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for theme_name, room_name, names in (
+                ('Clockwork Vault', 'Gear Room', ('pendulum', 'cog', 'spring')),
+                ('Sunken Ship', 'Hold', ('anchor', 'compass')),
+            ):
+                theme = Theme.objects.create(name=theme_name)
+                room = Room.objects.create(theme=theme, name=room_name, description='...')
+                for name in names:
+                    Element.objects.create(room=room, name=name, puzzle='?', hint='!')
+
+    def test_served_from_the_catalog(self):
+        self.client.get('/api/fetch-elements/')
+        with self.assertNumQueries(0):
+            data = self.client.get('/api/fetch-elements/').json()
+        self.assertEqual(sorted(data['elements']), ['anchor', 'cog', 'compass', 'pendulum', 'spring'])
+        self.assertEqual((data['page'], data['pages'], data['count']), (1, 1, 5))
+
+    def test_filters_and_pages(self):
+        data = self.client.get('/api/fetch-elements/', {'theme': 'Sunken Ship'}).json()
+        self.assertEqual(sorted(data['elements']), ['anchor', 'compass'])
+        data = self.client.get('/api/fetch-elements/', {'room': 'gear room', 'page_size': 2, 'page': 2}).json()
+        self.assertEqual((len(data['elements']), data['page'], data['pages'], data['count']), (1, 2, 2, 3))
+
+        self.assertEqual(self.client.get('/api/fetch-elements/', {'page': 4, 'page_size': 2}).status_code, 404)
+        self.assertEqual(self.client.get('/api/fetch-elements/', {'page_size': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/fetch-elements/', {'page': 'last'}).status_code, 400)
+
+    def test_unchanged_pages_revalidate_to_304(self):
+        response = self.client.get('/api/fetch-elements/')
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get('/api/fetch-elements/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Element.objects.create(room=Room.objects.get(name='Hold'), name='lantern', puzzle='?', hint='!')
+        response = self.client.get('/api/fetch-elements/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('lantern', response.json()['elements'])
+
+
+class ReadinessTests(TransactionTestCase):
+
+    def setUp(self):
+        Theme.objects.create(name='Clockwork Vault')
+        warmup._ready.clear()
+        self.addCleanup(warmup._ready.set)
+
+    def test_ready_only_after_warm_up(self):
+        response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'status': 'warming'})
+
+        deadline = time.monotonic() + 60
+        while not warmup.is_ready() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-store', response['Cache-Control'])
+
+    def test_views_import_without_heavy_dependencies(self):
+        code = (
+            "import sys, django; django.setup(); import chatbot.urls; "
+            "print(sorted({'spacy', 'PIL', 'requests', 'httpx'} & set(sys.modules)))"
+        )
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), '[]')
+
+
+class QueueLoggingTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'logs', 'test.log')
+        self.logger = logging.getLogger('chatbot.tests.queue')
+        self.logger.propagate = False
+        self.addCleanup(setattr, self.logger, 'propagate', True)
+
+    def handler(self, **options):
+        handler = QueueingHandler(self.filename, **options)
+        handler.setFormatter(JsonFormatter())
+        self.logger.addHandler(handler)
+        self.addCleanup(handler.close)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def test_writes_json_records_from_the_listener(self):
+        handler = self.handler()
+        try:
+            raise ValueError('bad gear')
+        except ValueError:
+            self.logger.exception('Turn %s failed', 3, extra={'session_id': 'abc'})
+        handler.flush()
+
+        with open(self.filename) as log:
+            record = json.loads(log.read())
+        self.assertEqual(record['message'], 'Turn 3 failed')
+        self.assertEqual((record['level'], record['logger']), ('ERROR', 'chatbot.tests.queue'))
+        self.assertEqual(record['session_id'], 'abc')
+        self.assertIn('ValueError: bad gear', record['exception'])
+        # The thread that logged, not the listener that wrote it
+        self.assertEqual(record['thread'], 'MainThread')
+
+    def test_rotates_the_file(self):
+        handler = self.handler(max_bytes=500, backup_count=2)
+        for number in range(20):
+            self.logger.error('Record %d', number)
+        handler.flush()
+        self.assertTrue(os.path.exists(self.filename + '.1'))
+        self.assertFalse(os.path.exists(self.filename + '.3'))
+
+    def test_settings_configure_the_handler(self):
+        # Replaces Django's handler with an identical one
+        logging.config.dictConfig(settings.LOGGING)
+        handlers = logging.getLogger().handlers
+        self.assertEqual([type(handler) for handler in handlers], [QueueingHandler])
+        self.assertIsInstance(handlers[0].target.formatter, JsonFormatter)
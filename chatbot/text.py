@@ -0,0 +1,78 @@
+import threading
+import unicodedata
+
+from django.conf import settings
+
+from .lru import LRUCache
+
+MODEL_NAME = "en_core_web_md"
+
+# The rule-based lemmatizer reads POS from the tagger (via attribute_ruler),
+# and the tagger needs tok2vec; nothing in preprocessing uses the parser or
+# NER. Static vectors stay loaded either way because tok2vec embeds them.
+PIPELINE_EXCLUDES = {
+    "full": (),
+    "lemmatizer": ("parser", "ner", "senter"),
+}
+
+# Stop words that can carry the meaning of an answer, so preprocessing keeps them
+KEPT_STOP_WORDS = {"is", "am", "are", "be", "was", "were", "a", "an", "the"}
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+# Players repeat the same short inputs ("fire", "27", "hint") constantly, so
+# lemmatized results are memoized per process, keyed on the normalized text
+_preprocess_cache = LRUCache(getattr(settings, 'PREPROCESS_CACHE_SIZE', 4096))
+
+
+def normalize_string(text):
+    """Lowercase, NFKD-normalize and strip text; falsy values pass through"""
+    return unicodedata.normalize('NFKD', text.lower()).strip() if text else text
+
+
+def load_nlp(mode=None):
+    """
+    Load the spaCy model in the given pipeline mode (NLP_PIPELINE_MODE by default)
+    """
+    mode = mode or getattr(settings, 'NLP_PIPELINE_MODE', 'full')
+    if mode not in PIPELINE_EXCLUDES:
+        raise ValueError(f"Unknown NLP pipeline mode: {mode!r}")
+    # Imported here so importing this module (and the views) stays cheap
+    import spacy
+
+    return spacy.load(MODEL_NAME, exclude=PIPELINE_EXCLUDES[mode])
+
+
+def get_nlp():
+    """Load the spaCy model once per process"""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                _nlp = load_nlp()
+    return _nlp
+
+
+def lemmatize(nlp, text):
+    """Lemmas of already-normalized text, minus stop words that carry no meaning"""
+    return " ".join(
+        token.lemma_ for token in nlp(text)
+        if not token.is_stop or token.lemma_ in KEPT_STOP_WORDS
+    )
+
+
+def preprocess_text(text):
+    """
+    Lemmatize text and drop stop words, keeping the ones that matter for answers
+    """
+    if not text:
+        return ""
+    return _preprocess_cache.get_or_compute(
+        normalize_string(text), lambda normalized: lemmatize(get_nlp(), normalized)
+    )
+
+
+def preprocess_cache_stats():
+    """Hit, miss and eviction counters of this process's preprocessing cache"""
+    return _preprocess_cache.stats()
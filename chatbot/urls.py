@@ -4,5 +4,12 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('chatbot/', views.chatbot_response, name='chatbot_response'),
+    path('async/chatbot/', views.chatbot_response_async, name='chatbot_response_async'),
+    path('chatbot/stream/', views.chatbot_stream, name='chatbot_stream'),
+    path('ready/', views.readiness, name='readiness'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('api/fetch-elements/', views.fetch_elements, name='fetch_elements'),
+    path('api/images/<str:job_id>/', views.image_job_status, name='image_job_status'),
+    path('images/<str:key>', views.generated_image, name='generated_image'),
+    path('images/<str:key>/<str:rendition>', views.generated_image, name='generated_image_rendition'),
 ]
@@ -1,20 +1,33 @@
+import asyncio
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.core.paginator import InvalidPage, Paginator
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from .logic import PuzzleLogic
+from .catalog import get_catalog
+from .images import image_store
+from .encoding import FULL, renditions
+from .jobs import FAILED, READY, ajob_status, await_job, job_status
+from .warmup import is_ready, start_warm_up
+from . import metrics
 import logging
-import traceback
-from io import BytesIO
-from PIL import Image
-import requests
 from django.views.decorators.csrf import csrf_exempt
-from .models import Element
+from .text import normalize_string
 import uuid
-# Configure logging
-logging.basicConfig(
-    level=logging.ERROR,
-    format='%(asctime)s - %(levelname)s: %(message)s',
-    filename='django_errors.log'
-)
+
+logger = logging.getLogger(__name__)
+
+SSE_HEARTBEAT_SECONDS = 15
+
+# Largest page of element names a client may ask fetch_elements for
+ELEMENTS_MAX_PAGE_SIZE = 1000
 
 class EscapeRoomView:  # Changed from object to regular class
     def __init__(self, session=None):  # Added default None parameter
@@ -23,13 +36,11 @@ class EscapeRoomView:  # Changed from object to regular class
             if 'game_session_id' not in session:
                 session['game_session_id'] = str(uuid.uuid4())
             self.puzzle_logic.set_session(session['game_session_id'])
-            state = session.get('puzzle_logic_state', None)
-            if state:
-                self.puzzle_logic.from_dict(state)
 
     def save_session(self, session):
-        session['puzzle_logic_state'] = self.puzzle_logic.to_dict()
-        session.modified = True
+        # Game state lives in UserGameSession; the Django session only
+        # carries game_session_id
+        self.puzzle_logic.flush_session()
 
     def get_initial_puzzle(self):
         if not self.puzzle_logic.game_started:
@@ -47,6 +58,33 @@ def index(request):
     view.save_session(request.session)
     return render(request, 'index.html', {'initial_puzzle': initial_puzzle})
 
+def game_response_data(correct, response):
+    """JSON body for the result of PuzzleLogic.play_game()"""
+    response_data = {"response": ""}
+
+    if not correct and "Out of lives!" in response:
+        response_data["reload"] = True
+
+    if isinstance(response, dict):
+        response_data["response"] = response.get("text", "")
+        response_data["error"] = response.get("error", False)
+
+        if response.get("image_job"):
+            # The page polls image_job_status until generation finishes,
+            # unless the view finds the image stored and links it directly
+            response_data["image_job"] = response["image_job"]
+            response_data["success"] = response.get("success", False)
+    else:
+        response_data["response"] = response
+    return response_data
+
+
+def link_stored_image(response_data):
+    image_job = response_data.pop("image_job")
+    response_data["image_url"] = image_url(image_job)
+    response_data["image_urls"] = image_urls(image_job)
+
+
 @csrf_exempt
 def chatbot_response(request):
     try:
@@ -60,27 +98,17 @@ def chatbot_response(request):
         if not user_input:
             return JsonResponse({"error": "Empty user input"}, status=400)
         
-        response_data = {"response": ""}
-        
         try:
-            correct, response = view.puzzle_logic.play_game(user_input)
-            
-            if not correct and "Out of lives!" in response:
-                response_data["reload"] = True
-                
-            if isinstance(response, dict):
-                response_data["response"] = response.get("text", "")
-                response_data["error"] = response.get("error", False)
-                response_data["retry"] = response.get("retry", False)
-                
-                if response.get("image"):
-                    response_data["image"] = response["image"]
-                    response_data["success"] = response.get("success", False)
-            else:
-                response_data["response"] = response
+            with metrics.timed('play'):
+                correct, response = view.puzzle_logic.play_game(user_input)
+            response_data = game_response_data(correct, response)
+
+            image_job = response_data.get("image_job")
+            if image_job and job_status(image_job) == READY:
+                link_stored_image(response_data)
         
         except Exception as game_error:
-            logging.error(f"Game logic error: {game_error}")
+            logger.error(f"Game logic error: {game_error}")
             return JsonResponse({
                 "error": True, 
                 "response": "An error occurred. Please try interacting with the element again."
@@ -90,14 +118,233 @@ def chatbot_response(request):
         return JsonResponse(response_data)
     
     except Exception as e:
-        logging.error(f"Detailed Error: {e}")
+        logger.error(f"Detailed Error: {e}")
         return JsonResponse({
             "error": True,
             "response": "An unexpected error occurred. Please try again."
         }, status=500)
 
 
+async def play_message_async(request):
+    """
+    Handle a chat message for the async views; returns (response data, status).
+    Game state is read and written through the async cache and ORM APIs;
+    PuzzleLogic's blocking work (catalog queries, spaCy) runs on the request's
+    worker thread, and its images are generated as coroutines on the job
+    event loop.
+    """
+    try:
+        if request.method != 'POST':
+            return {"error": "Invalid request method"}, 405
+
+        user_input = request.POST.get('user_input', '').strip()
+
+        if not user_input:
+            return {"error": "Empty user input"}, 400
+
+        session_id = await request.session.aget('game_session_id')
+        if not session_id:
+            session_id = str(uuid.uuid4())
+            await request.session.aset('game_session_id', session_id)
+
+        puzzle_logic = await sync_to_async(PuzzleLogic)()
+        puzzle_logic.async_images = True
+        await puzzle_logic.aset_session(session_id)
+
+        try:
+            with metrics.timed('play'):
+                correct, response = await sync_to_async(puzzle_logic.play_game)(user_input)
+            response_data = game_response_data(correct, response)
+
+            image_job = response_data.get("image_job")
+            if image_job and await ajob_status(image_job) == READY:
+                link_stored_image(response_data)
+
+        except Exception as game_error:
+            logger.error(f"Game logic error: {game_error}")
+            return {
+                "error": True,
+                "response": "An error occurred. Please try interacting with the element again."
+            }, 500
+
+        await puzzle_logic.aflush_session()
+        return response_data, 200
+
+    except Exception as e:
+        logger.error(f"Detailed Error: {e}")
+        return {
+            "error": True,
+            "response": "An unexpected error occurred. Please try again."
+        }, 500
+
+
+@csrf_exempt
+async def chatbot_response_async(request):
+    """chatbot_response for ASGI servers"""
+    response_data, status = await play_message_async(request)
+    return JsonResponse(response_data, status=status)
+
+
+@csrf_exempt
+async def chatbot_stream(request):
+    """
+    Chat over Server-Sent Events: the reply is sent as a `message` event as
+    soon as the game has handled it, then the same connection carries an
+    `image` (or `image-failed`) event when the room or element image is done.
+    If generation outlasts IMAGE_STREAM_TIMEOUT an `image-pending` event tells
+    the page to poll image_job_status instead. A `done` event ends the stream.
+    """
+    response_data, status = await play_message_async(request)
+    if status != 200:
+        return JsonResponse(response_data, status=status)
+
+    response = StreamingHttpResponse(chat_events(response_data), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep proxies (nginx) from buffering the image event behind the reply
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def chat_events(response_data):
+    yield sse_event('message', response_data)
+
+    image_job = response_data.get("image_job")
+    if image_job:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + getattr(settings, 'IMAGE_STREAM_TIMEOUT', 60)
+        event, payload = 'image-pending', {"image_job": image_job}
+        while True:
+            wait = max(min(deadline - loop.time(), SSE_HEARTBEAT_SECONDS), 0)
+            status = await await_job(image_job, wait)
+            if status == READY:
+                event = 'image'
+                payload = {
+                    "image_job": image_job,
+                    "image_url": image_url(image_job),
+                    "image_urls": image_urls(image_job),
+                }
+                break
+            if status == FAILED:
+                event = 'image-failed'
+                break
+            if loop.time() >= deadline:
+                break
+            # Comment line; stops idle-connection timeouts in routers
+            yield ": keep-alive\n\n"
+        yield sse_event(event, payload)
+
+    yield sse_event('done', {})
+
+
+def readiness(request):
+    """
+    200 once this worker has loaded the NLP model and catalog, 503 until
+    then, so the load balancer only routes players to warm workers
+    """
+    if is_ready():
+        response = JsonResponse({'status': 'ready'})
+    else:
+        start_warm_up()
+        response = JsonResponse({'status': 'warming'}, status=503)
+    patch_cache_control(response, no_store=True)
+    return response
+
+
+def metrics_view(request):
+    """Phase and request histograms of this process, for Prometheus to scrape"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @csrf_exempt  # Add this decorator
 def fetch_elements(request):
-    elements = Element.objects.values_list('name', flat=True)
-    return JsonResponse({"elements": list(elements)})
+    """
+    Element names from the catalog snapshot, optionally only those of one
+    `theme` or `room`, a `page` of `page_size` at a time. Responses carry an
+    ETag of their content, so revalidating an unchanged page is a 304.
+    """
+    theme = normalize_string(request.GET.get('theme'))
+    room_name = normalize_string(request.GET.get('room'))
+    try:
+        page_size = int(request.GET.get('page_size', getattr(settings, 'ELEMENTS_PAGE_SIZE', 500)))
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        return JsonResponse({"error": "page and page_size must be integers"}, status=400)
+    if not 1 <= page_size <= ELEMENTS_MAX_PAGE_SIZE:
+        return JsonResponse({"error": f"page_size must be between 1 and {ELEMENTS_MAX_PAGE_SIZE}"}, status=400)
+
+    names = [
+        name
+        for theme_key, room in get_catalog().rooms.items()
+        if (not theme or theme_key == theme)
+        and (not room_name or normalize_string(room['room_name']) == room_name)
+        for name in room['elements']
+    ]
+    try:
+        page = Paginator(names, page_size).page(number)
+    except InvalidPage:
+        raise Http404("Page not found")
+
+    data = {
+        "elements": list(page),
+        "page": page.number,
+        "pages": page.paginator.num_pages,
+        "count": page.paginator.count,
+    }
+    etag = f'"{hashlib.sha256(json.dumps(data).encode()).hexdigest()[:32]}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(data)
+    response['ETag'] = etag
+    # Stored by the browser, but revalidated on every page load
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def image_url(key, rendition=FULL):
+    if rendition == FULL:
+        return reverse('generated_image', args=[key])
+    return reverse('generated_image_rendition', args=[key, rendition])
+
+
+def image_urls(key):
+    """URL of every rendition of an image, by rendition name"""
+    return {rendition: image_url(key, rendition) for rendition in renditions()}
+
+
+def image_job_status(request, job_id):
+    status = job_status(job_id)
+    response_data = {"status": status}
+    if status == READY:
+        response_data["image_url"] = image_url(job_id)
+        response_data["image_urls"] = image_urls(job_id)
+    return JsonResponse(response_data)
+
+
+def generated_image(request, key, rendition=FULL):
+    """
+    Serve a stored image rendition. Keys are content addresses, so a URL's
+    bytes never change and browsers and CDNs may cache them for good.
+
+    Images stored before a rendition was configured only have the full one,
+    and the key doesn't change with IMAGE_RENDITIONS, so those are served
+    the full image for any configured rendition.
+    """
+    image = image_store.get_entry(key, rendition)
+    if image is None and rendition != FULL and rendition in renditions():
+        image = image_store.get_entry(key, FULL)
+    if image is None:
+        raise Http404("Image not found")
+
+    etag = f'"{key}-{image.rendition}-{image.content_type.rpartition("/")[2]}"'
+    last_modified = int(image.created_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(bytes(image.data), content_type=image.content_type)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
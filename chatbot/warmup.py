@@ -0,0 +1,84 @@
+"""
+Load what the first request would otherwise pay for: the view modules, the
+spaCy pipeline and the catalog snapshot (whose answer matchers are
+lemmatized with it).
+
+Under gunicorn's preload mode (see gunicorn.conf.py) this runs once in the
+master, so forked workers start warm and share the model's pages
+copy-on-write instead of each loading a private copy. Without preloading,
+each worker warms itself before it takes traffic (gunicorn's
+post_worker_init), and the readiness endpoint reports 503 until this
+process is warm, starting the warm-up in the background if nothing has.
+Importing the views doesn't import spaCy, Pillow or the HTTP clients; they
+load here or on first use.
+"""
+import gc
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import connections
+from django.urls import get_resolver
+
+from .catalog import get_catalog
+from .text import get_nlp
+
+logger = logging.getLogger(__name__)
+
+# Set once this process (or the master it was forked from) is warm
+_ready = threading.Event()
+_warming = threading.Lock()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def warm_up():
+    """
+    Load the NLP pipeline and the catalog and mark the process ready;
+    returns the seconds it took
+    """
+    start = time.perf_counter()
+    # Importing the URLconf imports every view module and what they use
+    get_resolver().url_patterns
+    get_nlp()
+    try:
+        get_catalog()
+    except Exception as e:
+        # Not ready yet: the next readiness probe retries
+        logger.error(f"Catalog warm-up failed: {e}")
+    else:
+        _ready.set()
+    return time.perf_counter() - start
+
+
+def start_warm_up():
+    """Warm up on a background thread unless already warm or warming"""
+    if _ready.is_set() or not _warming.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            warm_up()
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}")
+        finally:
+            connections.close_all()
+            _warming.release()
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+    return True
+
+
+def prepare_for_fork():
+    """
+    Drop connections the children must not share, then move every object
+    that exists now into the permanent GC generation, so collections in the
+    workers don't write to (and un-share) the pages holding them.
+    """
+    connections.close_all()
+    caches.close_all()
+    gc.collect()
+    gc.freeze()
@@ -54,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its Server-Timing total covers the rest
+    'chatbot.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -103,6 +105,86 @@ DATABASES = {
 }
 
 
+# Cache
+# Game state (GAME_STATE_BACKEND = 'cache') and image job states live here, so
+# point REDIS_URL at a backend every worker shares.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# Where game state is read from: "db" reads and writes UserGameSession on
+# every message; "cache" serves sessions from the cache above and persists
+# changes behind the request, in batches of up to GAME_STATE_FLUSH_BATCH at
+# least every GAME_STATE_FLUSH_INTERVAL seconds. Needs a cache shared by all
+# workers, so it defaults on only with Redis.
+GAME_STATE_BACKEND = os.getenv('GAME_STATE_BACKEND', 'cache' if os.getenv('REDIS_URL') else 'db')
+GAME_STATE_CACHE_TIMEOUT = 24 * 60 * 60
+GAME_STATE_FLUSH_INTERVAL = 2.0
+GAME_STATE_FLUSH_BATCH = 100
+
+# Seconds a worker may serve a catalog snapshot before re-reading it, as a
+# safety net for edits that bypass model signals (QuerySet.update()).
+CATALOG_MAX_AGE = 300
+
+# Seconds a worker trusts the catalog version stamp it last read from the
+# database; edits reach every worker within this interval
+CATALOG_VERSION_CHECK_INTERVAL = 2
+
+# Element names per page of /api/fetch-elements/ (clients may ask for up to 1000)
+ELEMENTS_PAGE_SIZE = 500
+
+# spaCy pipeline used for answer preprocessing: "full" loads every component
+# of en_core_web_md, "lemmatizer" skips the parser and NER, which lemmas and
+# stop words don't need. Check parity with `manage.py benchmark_nlp` first.
+NLP_PIPELINE_MODE = os.getenv('NLP_PIPELINE_MODE', 'full')
+
+# Entries in the per-process memo of preprocessed player inputs and answers
+PREPROCESS_CACHE_SIZE = 4096
+
+# Image generation endpoint, and the byte budget of the generated image store
+HF_INFERENCE_URL = os.getenv(
+    'HF_INFERENCE_URL',
+    'https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0'
+)
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Stored image encoding (WEBP, JPEG or PNG) and quality, and the renditions kept
+# of each image as a scale of its requested size ('full' is always kept)
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'WEBP')
+IMAGE_QUALITY = 80
+IMAGE_RENDITIONS = {'full': 1.0, 'small': 0.5}
+
+# Threads per worker process that run image generation off the request path
+IMAGE_GENERATION_WORKERS = 4
+
+# Image generations a process keeps in flight on its job event loop when
+# requests come through the async chat endpoint (async/chatbot/), which is
+# meant to be served by an ASGI worker:
+#   gunicorn escaperoom.asgi -k uvicorn_worker.UvicornWorker
+IMAGE_GENERATION_ASYNC_LIMIT = 100
+
+# How long the streaming chat endpoint (chatbot/stream/) holds a connection
+# open for an image, in seconds. Jobs running in the same process wake the
+# stream when they finish; a job running in another worker is checked on
+# every POLL_INTERVAL seconds
+IMAGE_STREAM_TIMEOUT = 60
+IMAGE_STREAM_POLL_INTERVAL = 2
+
+# Inference calls: retries with exponential backoff (seconds), and the circuit
+# breaker that fails fast after consecutive failed calls until RESET has passed
+INFERENCE_TIMEOUT = 30
+INFERENCE_MAX_RETRIES = 3
+INFERENCE_BACKOFF = 1.0
+INFERENCE_MAX_BACKOFF = 20.0
+INFERENCE_BREAKER_THRESHOLD = 5
+INFERENCE_BREAKER_RESET = 30.0
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -154,4 +236,49 @@ STATICFILES_DIRS = [
 # Add to your settings.py
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 SESSION_COOKIE_SECURE = True
+# The session only carries game_session_id (game state is in UserGameSession),
+# so it rides in a signed cookie instead of costing a django_session query
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 CSRF_COOKIE_SECURE = True
+
+# Logs are queued on the request thread and written by a background listener
+# (chatbot.log), one JSON object per line, to stderr for the platform to
+# collect. Setting LOG_FILE (e.g. logs/escaperoom.log) writes a rotated file
+# instead, which suits a single process: every worker rotates its own view.
+LOG_FILE = os.getenv('LOG_FILE', '')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING')
+
+# Per-logger levels; LOG_LEVELS="chatbot=DEBUG,django.db.backends=DEBUG" adds
+# to or overrides these
+LOG_LEVELS = {
+    'chatbot': 'INFO',
+    'django': 'INFO',
+    # Every autoreload restart, which is most of what the old logs held
+    'django.utils.autoreload': 'WARNING',
+}
+for _entry in filter(None, os.getenv('LOG_LEVELS', '').split(',')):
+    _name, _, _level = _entry.partition('=')
+    LOG_LEVELS[_name.strip()] = _level.strip().upper()
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'chatbot.log.JsonFormatter'},
+    },
+    'handlers': {
+        'queue': {
+            # A factory, not 'class': from Python 3.12 dictConfig configures
+            # QueueHandler subclasses itself and rejects these arguments
+            '()': 'chatbot.log.QueueingHandler',
+            'formatter': 'json',
+            'filename': LOG_FILE or None,
+            'max_bytes': LOG_MAX_BYTES,
+            'backup_count': LOG_BACKUP_COUNT,
+        },
+    },
+    'root': {'handlers': ['queue'], 'level': LOG_LEVEL},
+    'loggers': {name: {'level': level} for name, level in LOG_LEVELS.items()},
+}
@@ -0,0 +1,29 @@
+"""
+Gunicorn settings, picked up automatically from the working directory.
+
+Preloading (on unless GUNICORN_PRELOAD=false) imports the app in the master
+and warms the spaCy model and catalog there before forking, so workers
+start ready and share those pages instead of each loading its own copy.
+Otherwise each worker warms itself before accepting connections.
+Measure the difference with `python manage.py benchmark_workers`.
+"""
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() not in ('0', 'false', 'no')
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from chatbot.warmup import prepare_for_fork, warm_up
+
+    server.log.info("Preloaded models and catalog in %.1fs", warm_up())
+    prepare_for_fork()
+
+
+def post_worker_init(worker):
+    from chatbot.warmup import is_ready, warm_up
+
+    # Already warm when forked from a preloaded master
+    if not is_ready():
+        worker.log.info("Worker warmed up in %.1fs", warm_up())